@@ -0,0 +1,391 @@
+import os
+import json
+import hashlib
+import shutil
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Optional
+import config
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Папка дискового кэша и его максимальный размер
+AUDIO_CACHE_DIR = getattr(config, 'AUDIO_CACHE_DIR', os.path.join(config.TEMP_AUDIO_DIR, 'cache'))
+AUDIO_CACHE_MAX_BYTES = getattr(config, 'AUDIO_CACHE_MAX_BYTES', 500 * 1024 * 1024)
+
+CACHE_FILE_SUFFIX = '.audio'
+
+
+def normalize_text(text: str) -> str:
+    """
+    Приводит текст к каноническому виду для ключа кэша
+
+    Args:
+        text (str): Исходный текст
+
+    Returns:
+        str: Текст в форме NFC со схлопнутыми пробелами
+    """
+    text = unicodedata.normalize('NFC', text)
+    return ' '.join(text.split())
+
+
+def make_cache_key(text: str, voice_id: str, model_id: str, output_format: str) -> str:
+    """
+    Строит ключ кэша по тексту и параметрам синтеза
+
+    Args:
+        text (str): Текст для озвучки
+        voice_id (str): ID голоса
+        model_id (str): ID модели ElevenLabs
+        output_format (str): Формат аудио ElevenLabs
+
+    Returns:
+        str: sha256 в hex
+    """
+    payload = '\x1f'.join([normalize_text(text), voice_id, model_id, output_format])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AudioCache:
+    """Постоянный дисковый кэш синтезированного аудио с LRU вытеснением"""
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> размер файла, от самого старого к самому свежему
+        self._total_bytes = 0
+        self._indexed = False
+
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_SUFFIX)
+
+    def load_index(self):
+        """
+        Восстанавливает LRU-индекс по файлам на диске (порядок - по времени последнего доступа).
+        Вызывается при прогреве или перед первой записью: поиск находит файлы и без индекса
+        """
+        if self._indexed:
+            return
+        files = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(CACHE_FILE_SUFFIX):
+                continue
+            file_path = os.path.join(self.directory, filename)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, filename[:-len(CACHE_FILE_SUFFIX)], stat.st_size))
+
+        with self._lock:
+            if self._indexed:
+                return
+            # Найденные до построения индекса записи уже свежее файлов с диска
+            for _, key, size in sorted(files, reverse=True):
+                if key in self._entries:
+                    continue
+                self._entries[key] = size
+                self._entries.move_to_end(key, last=False)
+                self._total_bytes += size
+            self._indexed = True
+            self._evict_locked()
+
+    def _evict_locked(self):
+        """Удаляет самые давно использованные записи, пока кэш больше лимита"""
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _adopt_locked(self, key: str) -> bool:
+        """Добавляет в индекс файл, записанный другим процессом с общим кэшем"""
+        try:
+            size = os.path.getsize(self._path(key))
+        except OSError:
+            return False
+        self._entries[key] = size
+        self._total_bytes += size
+        self._evict_locked()
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Ищет аудио в кэше
+
+        Args:
+            key (str): Ключ из make_cache_key
+
+        Returns:
+            Optional[str]: Путь к файлу в кэше или None при промахе
+        """
+        with self._lock:
+            if key in self._entries or self._adopt_locked(key):
+                file_path = self._path(key)
+                if os.path.exists(file_path):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    try:
+                        # mtime хранит порядок LRU между перезапусками
+                        os.utime(file_path)
+                    except OSError:
+                        pass
+                    return file_path
+                self._total_bytes -= self._entries.pop(key)
+            self.misses += 1
+            return None
+
+    def contains(self, key: str) -> bool:
+        """Проверяет наличие записи, не влияя на счетчики и порядок LRU"""
+        with self._lock:
+            return key in self._entries or self._adopt_locked(key)
+
+    def get_bytes(self, key: str) -> Optional[bytes]:
+        """
+        Читает аудио из кэша в память
+
+        Args:
+            key (str): Ключ из make_cache_key
+
+        Returns:
+            Optional[bytes]: Аудио или None при промахе
+        """
+        file_path = self.get(key)
+        if not file_path:
+            return None
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read()
+        except OSError:
+            # Файл вытеснили между get и чтением
+            return None
+
+    def put_file(self, key: str, source_path: str) -> Optional[str]:
+        """
+        Копирует готовый аудио файл в кэш
+
+        Args:
+            key (str): Ключ из make_cache_key
+            source_path (str): Путь к сгенерированному файлу
+
+        Returns:
+            Optional[str]: Путь к файлу в кэше или None, если файл больше всего кэша
+        """
+        size = os.path.getsize(source_path)
+        if size > self.max_bytes:
+            return None
+
+        file_path = self._path(key)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, file_path)
+        self._add_entry(key, size)
+        return file_path
+
+    def put_bytes(self, key: str, data: bytes) -> Optional[str]:
+        """
+        Сохраняет аудио из памяти в кэш
+
+        Args:
+            key (str): Ключ из make_cache_key
+            data (bytes): Аудио
+
+        Returns:
+            Optional[str]: Путь к файлу в кэше или None, если аудио больше всего кэша
+        """
+        size = len(data)
+        if size > self.max_bytes:
+            return None
+
+        file_path = self._path(key)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+        self._add_entry(key, size)
+        return file_path
+
+    def _add_entry(self, key: str, size: int):
+        self.load_index()
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)
+            self._entries[key] = size
+            self._total_bytes += size
+            self._evict_locked()
+
+    def stats(self) -> Dict:
+        """
+        Возвращает счетчики кэша
+
+        Returns:
+            Dict: Попадания, промахи, число записей и занятый объем
+        """
+        self.load_index()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+            }
+
+
+# Максимум file_id, которые помним (самые давно использованные забываются)
+FILE_ID_STORE_MAX_ENTRIES = getattr(config, 'FILE_ID_STORE_MAX_ENTRIES', 100000)
+
+
+class FileIdStore:
+    """
+    Соответствие ключ кэша -> Telegram file_id для уже отправленного аудио.
+
+    Хранится в append-only журнале: каждая запись - одна строка JSON,
+    при загрузке побеждает последняя строка, журнал периодически сжимается.
+    Журнал можно делить между процессами: записи и сжатие идут под файловой
+    блокировкой, а при промахе дочитываются строки, добавленные другими процессами.
+    """
+
+    def __init__(self, path: str = None, max_entries: int = FILE_ID_STORE_MAX_ENTRIES):
+        self.path = path or os.path.join(AUDIO_CACHE_DIR, 'file_ids.jsonl')
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> file_id
+        self._log_lines = 0
+        self._offset = 0  # сколько байт журнала уже прочитано
+        self._inode = None
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._lock:
+            self._read_new_locked()
+            if self._log_lines > 2 * max(len(self._entries), 1000):
+                with self._file_lock():
+                    self._compact_locked()
+
+    @contextmanager
+    def _file_lock(self):
+        """Межпроцессная блокировка журнала (без fcntl - только внутри процесса)"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_new_locked(self):
+        """Дочитывает строки журнала, добавленные с прошлого чтения (в том числе другими процессами)"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            # Журнал сжат (возможно, другим процессом) - перечитываем целиком
+            self._entries.clear()
+            self._offset = 0
+            self._log_lines = 0
+            self._inode = stat.st_ino
+        if stat.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Недописанную последнюю строку прочитаем в следующий раз
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            self._log_lines += 1
+            try:
+                record = json.loads(line)
+                key, file_id = record['k'], record['f']
+            except (ValueError, KeyError, TypeError):
+                continue
+            self._entries.pop(key, None)
+            if file_id:
+                self._entries[key] = file_id
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _append_locked(self, key: str, file_id: Optional[str]):
+        with self._file_lock():
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'k': key, 'f': file_id}) + '\n')
+            self._read_new_locked()
+            if self._log_lines > 2 * max(self.max_entries, 1000):
+                self._compact_locked()
+
+    def _compact_locked(self):
+        """Переписывает журнал, оставляя только актуальные записи (вызывается под файловой блокировкой)"""
+        self._read_new_locked()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, file_id in self._entries.items():
+                f.write(json.dumps({'k': key, 'f': file_id}) + '\n')
+        os.replace(tmp_path, self.path)
+        stat = os.stat(self.path)
+        self._inode = stat.st_ino
+        self._offset = stat.st_size
+        self._log_lines = len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Args:
+            key (str): Ключ кэша аудио
+
+        Returns:
+            Optional[str]: file_id или None, если аудио еще не отправлялось
+        """
+        with self._lock:
+            file_id = self._entries.get(key)
+            if not file_id:
+                # Возможно, клип уже отправил другой процесс
+                self._read_new_locked()
+                file_id = self._entries.get(key)
+            if file_id:
+                self._entries.move_to_end(key)
+            return file_id
+
+    def set(self, key: str, file_id: str):
+        """Запоминает file_id, полученный от Telegram после загрузки"""
+        with self._lock:
+            if self._entries.get(key) == file_id:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = file_id
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            try:
+                self._append_locked(key, file_id)
+            except OSError as e:
+                print(f"Не удалось сохранить file_id: {e}")
+
+    def discard(self, key: str):
+        """Забывает file_id, который Telegram больше не принимает"""
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+            try:
+                self._append_locked(key, None)
+            except OSError as e:
+                print(f"Не удалось сохранить file_id: {e}")
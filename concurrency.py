@@ -0,0 +1,254 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+
+class SingleFlight:
+    """
+    Объединяет одновременные вызовы с одинаковым ключом в один.
+
+    Первый вызов запускает задачу, остальные ждут ее результата. Отмена одного
+    из ожидающих не отменяет общую задачу для остальных.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+        self.started = 0  # сколько реальных вызовов выполнено
+        self.shared = 0  # сколько вызовов получили результат чужого запроса
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func или присоединяется к уже выполняющемуся вызову с тем же ключом
+
+        Args:
+            key (str): Ключ дедупликации
+            func (Callable): Фабрика корутины, вызывается только для первого запроса
+
+        Returns:
+            Any: Результат func (общий для всех ожидающих)
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            self.started += 1
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Помечаем исключение как полученное, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+
+class TokenBucket:
+    """Асинхронный token bucket: ограничивает расход (например, символов) в секунду"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float):
+        """
+        Ждет, пока в ведре наберется amount токенов, и списывает их.
+        Запросы обслуживаются по порядку; amount больше емкости урезается до емкости
+
+        Args:
+            amount (float): Сколько токенов нужно
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+
+
+class SchedulerTicket:
+    """Место в очереди FairScheduler; используется как async context manager"""
+
+    QUEUED, GRANTED, ACTIVE, DONE = range(4)
+
+    def __init__(self, scheduler: 'FairScheduler', user_id: int, cost: int):
+        self.user_id = user_id
+        self.cost = cost
+        self.position = 0  # позиция в очереди при постановке (0 - слот выдан сразу)
+        self.enqueued_at = time.monotonic()
+        self.wait_time = 0.0
+
+        self._scheduler = scheduler
+        self._state = self.QUEUED
+        self._granted = asyncio.get_running_loop().create_future()
+
+    @property
+    def granted(self) -> bool:
+        return self._state != self.QUEUED
+
+    def _grant(self):
+        self._state = self.GRANTED
+        if not self._granted.done():
+            self._granted.set_result(None)
+
+    async def __aenter__(self) -> 'SchedulerTicket':
+        try:
+            await self._granted
+            if self._scheduler.bucket:
+                await self._scheduler.bucket.acquire(self.cost)
+        except BaseException:
+            self.cancel()
+            raise
+        self._state = self.ACTIVE
+        self.wait_time = time.monotonic() - self.enqueued_at
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.cancel()
+
+    def cancel(self):
+        """Освобождает место в очереди или слот; повторный вызов ничего не делает"""
+        if self._state == self.DONE:
+            return
+        if self._state == self.QUEUED:
+            self._scheduler._remove(self)
+        else:
+            self._scheduler._release()
+        self._state = self.DONE
+
+
+class FairScheduler:
+    """
+    Планировщик запросов синтеза: у каждого пользователя своя очередь,
+    очереди обслуживаются по кругу (round-robin), одновременно выполняется
+    не больше max_concurrency запросов, а расход символов ограничен token bucket.
+    """
+
+    def __init__(self, max_concurrency: int, chars_per_minute: int = 0, max_pending_per_user: int = 10):
+        self.max_concurrency = max_concurrency
+        self.max_pending_per_user = max_pending_per_user
+        # Квота символов: ведро вмещает минутный лимит, пополняется равномерно
+        self.bucket = TokenBucket(chars_per_minute / 60.0, chars_per_minute) if chars_per_minute else None
+
+        self._queues: Dict[int, Deque[SchedulerTicket]] = {}
+        self._rotation: Deque[int] = deque()  # пользователи с ожидающими запросами, в порядке обслуживания
+        self.active = 0
+
+    @property
+    def queued(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def enqueue(self, user_id: int, cost: int) -> Optional[SchedulerTicket]:
+        """
+        Ставит запрос пользователя в очередь
+
+        Args:
+            user_id (int): ID пользователя Telegram
+            cost (int): Стоимость запроса в символах
+
+        Returns:
+            Optional[SchedulerTicket]: Билет или None, если у пользователя уже
+            max_pending_per_user ожидающих запросов
+        """
+        queue = self._queues.get(user_id)
+        if queue is not None and len(queue) >= self.max_pending_per_user:
+            return None
+
+        ticket = SchedulerTicket(self, user_id, cost)
+        if queue is None:
+            queue = self._queues[user_id] = deque()
+            self._rotation.append(user_id)
+        queue.append(ticket)
+
+        self._dispatch()
+        if not ticket.granted:
+            ticket.position = self.position(ticket)
+        return ticket
+
+    def pending(self, user_id: int) -> int:
+        """Сколько запросов пользователя ждут в очереди"""
+        queue = self._queues.get(user_id)
+        return len(queue) if queue else 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, cost: int) -> AsyncIterator[SchedulerTicket]:
+        """
+        Слот для одного запроса к ElevenLabs (например, фрагмента длинного текста).
+        Если очередь пользователя заполнена, ждет, пока в ней освободится место
+
+        Args:
+            user_id (int): ID пользователя Telegram
+            cost (int): Стоимость запроса в символах
+        """
+        ticket = self.enqueue(user_id, cost)
+        while ticket is None:
+            await asyncio.sleep(1)
+            ticket = self.enqueue(user_id, cost)
+        async with ticket:
+            yield ticket
+
+    def position(self, ticket: SchedulerTicket) -> int:
+        """
+        Номер запроса в очереди с учетом кругового обслуживания (1 - следующий)
+
+        Args:
+            ticket (SchedulerTicket): Ожидающий билет
+
+        Returns:
+            int: Позиция или 0, если слот уже выдан
+        """
+        queue = self._queues.get(ticket.user_id)
+        if ticket.granted or not queue:
+            return 0
+        rounds = queue.index(ticket)
+        position = rounds + 1
+        ahead = True
+        for user_id in self._rotation:
+            if user_id == ticket.user_id:
+                ahead = False
+                continue
+            # Пользователи впереди по кругу успеют получить на один слот больше
+            position += min(len(self._queues[user_id]), rounds + 1 if ahead else rounds)
+        return position
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency and self._rotation:
+            user_id = self._rotation.popleft()
+            queue = self._queues[user_id]
+            ticket = queue.popleft()
+            if queue:
+                self._rotation.append(user_id)
+            else:
+                del self._queues[user_id]
+            self.active += 1
+            ticket._grant()
+
+    def _remove(self, ticket: SchedulerTicket):
+        queue = self._queues.get(ticket.user_id)
+        if not queue or ticket not in queue:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[ticket.user_id]
+            self._rotation.remove(ticket.user_id)
+
+    def _release(self):
+        self.active -= 1
+        self._dispatch()
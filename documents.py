@@ -0,0 +1,426 @@
+import asyncio
+import logging
+import os
+import re
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, Optional, Tuple
+from xml.etree import ElementTree
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import ContextTypes
+import config
+from voice import TTS_CHUNK_FANOUT, TELEGRAM_MAX_AUDIO_BYTES, get_output_profile
+from upstream import UpstreamUnavailable
+from text_chunks import split_text, strip_id3
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на документ: размер файла и сколько символов из него озвучивается
+DOCUMENT_MAX_BYTES = getattr(config, 'DOCUMENT_MAX_BYTES', 5 * 1024 * 1024)
+DOCUMENT_MAX_CHARS = getattr(config, 'DOCUMENT_MAX_CHARS', 200000)
+# Размер одного аудио файла с озвучкой документа (части отправляются по мере готовности)
+DOCUMENT_PART_BYTES = getattr(config, 'DOCUMENT_PART_BYTES', TELEGRAM_MAX_AUDIO_BYTES)
+# Сколько секунд субтитров .srt попадает в одну часть (части делятся по границам субтитров);
+# None - части .srt делятся только по DOCUMENT_PART_BYTES
+DOCUMENT_SRT_PART_SECONDS = getattr(config, 'DOCUMENT_SRT_PART_SECONDS', 300)
+# Как часто (в секундах) обновлять сообщение с прогрессом
+DOCUMENT_PROGRESS_INTERVAL = getattr(config, 'DOCUMENT_PROGRESS_INTERVAL', 3.0)
+
+DOCUMENT_EXTENSIONS = ('.txt', '.docx', '.srt')
+# Opus-фрагменты не склеиваются, поэтому документы в формате голосовых озвучиваются в MP3
+DOCUMENT_FALLBACK_PROFILE = 'mp3_64'
+
+# Фрагмент документа: текст и время субтитра (для .srt) или None
+Segment = Tuple[str, Optional[str], Optional[str]]
+
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_SRT_TIME_RE = re.compile(r'(\d+:\d{2}:\d{2})[,.]\d+\s*-->\s*(\d+:\d{2}:\d{2})[,.]\d+')
+_SRT_TAG_RE = re.compile(r'<[^>]+>|\{[^}]*\}')
+
+
+def _srt_seconds(value: str) -> int:
+    """Время субтитра ЧЧ:ММ:СС в секундах"""
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+class _CountingReader:
+    """Считает прочитанные байты, чтобы показывать прогресс чтения документа"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.position += len(data)
+        return data
+
+
+def _detect_encoding(head: bytes) -> str:
+    """UTF-8 (с BOM или без), иначе cp1251 - самая частая кодировка русских .txt/.srt"""
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # Символ, обрезанный на границе прочитанного блока, не говорит о другой кодировке
+        if e.start < len(head) - 3:
+            return 'cp1251'
+    return 'utf-8-sig'
+
+
+class DocumentReader:
+    """
+    Читает документ по частям и отдает фрагменты для синтеза не длиннее max_chars.
+    Фрагменты режутся по абзацам (субтитрам), поэтому неизмененные части документа
+    при повторной отправке дают те же фрагменты и берутся из кэша аудио.
+    """
+
+    def __init__(self, path: str, extension: str, max_chars: int):
+        self.path = path
+        self.extension = extension
+        self.max_chars = max_chars
+        self.size = os.path.getsize(path)
+        self._reader: Optional[_CountingReader] = None
+        self._total: Optional[int] = None
+
+    @property
+    def fraction(self) -> float:
+        """Доля прочитанного документа (0..1)"""
+        if not self._reader:
+            return 0.0
+        # Для .docx считаем по распакованному XML
+        total = self._total or self.size
+        return min(1.0, self._reader.position / total) if total else 1.0
+
+    def __iter__(self) -> Iterator[Segment]:
+        if self.extension == '.docx':
+            paragraphs = self._docx_paragraphs()
+        elif self.extension == '.srt':
+            for text, start, end in self._srt_cues():
+                for chunk in split_text(text, self.max_chars):
+                    yield chunk, start, end
+            return
+        else:
+            paragraphs = self._text_paragraphs()
+        for paragraph in paragraphs:
+            for chunk in split_text(paragraph, self.max_chars):
+                yield chunk, None, None
+
+    def _lines(self) -> Iterator[str]:
+        with open(self.path, 'rb') as f:
+            encoding = _detect_encoding(f.read(64 * 1024))
+            f.seek(0)
+            self._reader = _CountingReader(f)
+            buffer = b''
+            while True:
+                block = self._reader.read(64 * 1024)
+                if not block:
+                    break
+                lines = (buffer + block).split(b'\n')
+                buffer = lines.pop()
+                for line in lines:
+                    yield line.decode(encoding, errors='replace').rstrip('\r')
+            if buffer:
+                yield buffer.decode(encoding, errors='replace').rstrip('\r')
+
+    def _text_paragraphs(self) -> Iterator[str]:
+        """Абзацы .txt, разделенные пустыми строками"""
+        lines = []
+        size = 0
+        for line in self._lines():
+            line = line.strip()
+            if line:
+                lines.append(line)
+                size += len(line) + 1
+            # Текст без пустых строк не копим целиком в памяти
+            if lines and (not line or size >= self.max_chars * 4):
+                yield ' '.join(lines)
+                lines = []
+                size = 0
+        if lines:
+            yield ' '.join(lines)
+
+    def _srt_cues(self) -> Iterator[Segment]:
+        """Субтитры .srt: текст и время начала/конца (ЧЧ:ММ:СС)"""
+        start = end = None
+        lines = []
+        for line in self._lines():
+            line = line.strip()
+            match = _SRT_TIME_RE.search(line)
+            if match:
+                start, end = match.groups()
+                lines = []
+            elif not line:
+                if start and lines:
+                    yield ' '.join(lines), start, end
+                start = end = None
+                lines = []
+            elif start:
+                text = _SRT_TAG_RE.sub('', line).strip()
+                if text:
+                    lines.append(text)
+            # Строка с номером субтитра до строки времени пропускается
+        if start and lines:
+            yield ' '.join(lines), start, end
+
+    def _docx_paragraphs(self) -> Iterator[str]:
+        """Абзацы word/document.xml, разобранные потоково без загрузки всего XML"""
+        with zipfile.ZipFile(self.path) as archive:
+            self._total = archive.getinfo('word/document.xml').file_size
+            with archive.open('word/document.xml') as stream:
+                self._reader = _CountingReader(stream)
+                parts = []
+                for event, element in ElementTree.iterparse(self._reader, events=('end',)):
+                    if element.tag == _WORD_NS + 't' and element.text:
+                        parts.append(element.text)
+                    elif element.tag in (_WORD_NS + 'tab', _WORD_NS + 'br'):
+                        parts.append(' ')
+                    elif element.tag == _WORD_NS + 'p':
+                        paragraph = ''.join(parts).strip()
+                        parts = []
+                        element.clear()
+                        if paragraph:
+                            yield paragraph
+
+
+class DocumentJob:
+    """Фоновая озвучка одного документа пользователя"""
+
+    def __init__(self, user_id: int, chat_id: int, file_id: str, name: str, voice_id: str, voice_name: str,
+                 profile: str, message):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.file_id = file_id
+        self.name = name
+        self.voice_id = voice_id
+        self.voice_name = voice_name
+        self.profile = profile
+        self.message = message  # сообщение с прогрессом и кнопкой отмены
+        self.task: Optional[asyncio.Task] = None
+        self.segments = 0
+        self.chars = 0
+        self.parts = 0
+        self.truncated = False
+
+
+class DocumentJobs:
+    """
+    Озвучка документов .txt, .docx и .srt фоновыми задачами (не больше одной на пользователя).
+
+    Документ читается потоково, фрагменты синтезируются по порядку с ограниченным
+    параллелизмом и дописываются во временный MP3; когда часть достигает
+    DOCUMENT_PART_BYTES (для .srt - или охватывает DOCUMENT_SRT_PART_SECONDS
+    субтитров), она отправляется пользователю. В памяти одновременно
+    не больше TTS_CHUNK_FANOUT фрагментов аудио.
+    """
+
+    CANCEL_CALLBACK = "cancel_document"
+
+    def __init__(self, voice_manager, scheduler):
+        self.voice_manager = voice_manager
+        self.scheduler = scheduler
+        self.jobs: Dict[int, DocumentJob] = {}
+        # Чтение и разбор документов (файловый ввод-вывод и XML) не блокируют event loop
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='document')
+
+    @staticmethod
+    def is_supported(name: Optional[str]) -> bool:
+        return bool(name) and os.path.splitext(name)[1].lower() in DOCUMENT_EXTENSIONS
+
+    def _cancel_keyboard(self) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("⏹ Отменить", callback_data=self.CANCEL_CALLBACK)]])
+
+    async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE, voice_id: str, voice_name: str,
+                    profile: str):
+        """Проверяет документ из сообщения и запускает его озвучку в фоне"""
+        user_id = update.effective_user.id
+        document = update.message.document
+
+        if not self.is_supported(document.file_name):
+            await update.message.reply_text("❌ Поддерживаются документы .txt, .docx и .srt.")
+            return
+        if document.file_size and document.file_size > DOCUMENT_MAX_BYTES:
+            await update.message.reply_text(
+                f"❌ Документ слишком большой! Максимум {DOCUMENT_MAX_BYTES // 1024 // 1024} МБ."
+            )
+            return
+        if user_id in self.jobs:
+            await update.message.reply_text("⏳ Дождитесь озвучки предыдущего документа или отмените ее.")
+            return
+
+        if get_output_profile(profile)['voice_note']:
+            profile = DOCUMENT_FALLBACK_PROFILE
+        message = await update.message.reply_text(
+            f"📄 {document.file_name}: готовлю озвучку...", reply_markup=self._cancel_keyboard()
+        )
+        job = DocumentJob(user_id, update.effective_chat.id, document.file_id, document.file_name,
+                          voice_id, voice_name, profile, message)
+        self.jobs[user_id] = job
+        job.task = asyncio.create_task(self._run(job, context.bot))
+
+    async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик кнопки отмены"""
+        job = self.jobs.get(update.effective_user.id)
+        if job and job.task:
+            job.task.cancel()
+        else:
+            try:
+                await update.callback_query.edit_message_reply_markup(reply_markup=None)
+            except Exception:
+                pass
+
+    def cancel_all(self):
+        for job in list(self.jobs.values()):
+            if job.task:
+                job.task.cancel()
+
+    async def _synthesize(self, job: DocumentJob, text: str) -> Optional[bytes]:
+        """Синтез фрагмента: из кэша сразу, иначе через общую очередь к ElevenLabs"""
+        key = self.voice_manager.cache_key(text, job.voice_id, job.profile)
+        if self.voice_manager.audio_cache.contains(key):
+            return await self.voice_manager.agenerate_audio_bytes(text, job.voice_id, job.profile)
+        # Если очередь пользователя заполнена его же сообщениями, документ подождет
+        async with self.scheduler.slot(job.user_id, len(text)):
+            return await self.voice_manager.agenerate_audio_bytes(text, job.voice_id, job.profile)
+
+    @staticmethod
+    def _part_span_full(first: Segment, segment: Segment) -> bool:
+        """Субтитр начинается за пределами DOCUMENT_SRT_PART_SECONDS от начала части"""
+        if not DOCUMENT_SRT_PART_SECONDS or not first[1] or not segment[1]:
+            return False
+        # Фрагменты одного субтитра имеют одно время начала и не разделяются
+        return _srt_seconds(segment[1]) - _srt_seconds(first[1]) >= DOCUMENT_SRT_PART_SECONDS
+
+    async def _progress(self, job: DocumentJob, text: str, keyboard: bool = True):
+        try:
+            await job.message.edit_text(text, reply_markup=self._cancel_keyboard() if keyboard else None)
+        except Exception:
+            pass
+
+    async def _send_part(self, bot: Bot, job: DocumentJob, path: str, first: Segment, last: Segment):
+        job.parts += 1
+        stem = os.path.splitext(job.name)[0]
+        caption = f"📄 {job.name} — часть {job.parts}\n🎤 {job.voice_name}"
+        if first[1]:
+            caption += f"\n⏱ {first[1]} – {last[2]}"
+        with open(path, 'rb') as audio_file:
+            await bot.send_audio(
+                chat_id=job.chat_id, audio=audio_file, filename=f"{stem}_{job.parts:02d}.mp3",
+                title=f"{stem} ({job.parts})", performer="ElevenLabs TTS Bot", caption=caption,
+            )
+
+    async def _run(self, job: DocumentJob, bot: Bot):
+        temp_files = self.voice_manager.temp_files
+        source_path = os.path.join(config.TEMP_AUDIO_DIR, f"doc_{job.user_id}_{job.message.message_id}.tmp")
+        part_path = os.path.join(config.TEMP_AUDIO_DIR, f"doc_{job.user_id}_{job.message.message_id}.mp3")
+        pending = deque()
+        outcome = 'error'
+        try:
+            with temp_files.hold(source_path), temp_files.hold(part_path):
+                telegram_file = await bot.get_file(job.file_id)
+                await telegram_file.download_to_drive(source_path)
+                extension = os.path.splitext(job.name)[1].lower()
+                reader = DocumentReader(source_path, extension, config.MAX_TEXT_LENGTH)
+                segments = iter(reader)
+                exhausted = False
+                part = None
+                part_size = 0
+                part_first = None
+                last_segment = None  # задан, когда part открыта
+                last_update = time.monotonic()
+                reading: Optional[Future] = None
+
+                try:
+                    while True:
+                        # Читаем документ вперед не больше чем на TTS_CHUNK_FANOUT фрагментов
+                        while not exhausted and len(pending) < TTS_CHUNK_FANOUT:
+                            reading = self._executor.submit(next, segments, None)
+                            segment = await asyncio.wrap_future(reading)
+                            if segment is None:
+                                exhausted = True
+                            elif job.chars + len(segment[0]) > DOCUMENT_MAX_CHARS:
+                                exhausted = job.truncated = True
+                            else:
+                                job.chars += len(segment[0])
+                                pending.append((segment, asyncio.ensure_future(self._synthesize(job, segment[0]))))
+                        if not pending:
+                            break
+
+                        segment, task = pending.popleft()
+                        audio = await task
+                        if audio is None:
+                            raise RuntimeError("Не удалось озвучить фрагмент документа")
+                        if part is not None and (part_size + len(audio) > DOCUMENT_PART_BYTES
+                                                 or self._part_span_full(part_first, segment)):
+                            part.close()
+                            part = None
+                            await self._send_part(bot, job, part_path, part_first, last_segment)
+                        if part is None:
+                            part = open(part_path, 'wb')
+                            part_size = 0
+                            part_first = segment
+                        else:
+                            audio = strip_id3(audio)
+                        part.write(audio)
+                        part_size += len(audio)
+                        last_segment = segment
+                        job.segments += 1
+
+                        if time.monotonic() - last_update >= DOCUMENT_PROGRESS_INTERVAL:
+                            last_update = time.monotonic()
+                            await self._progress(
+                                job, f"📄 {job.name}: прочитано {reader.fraction:.0%}, озвучено фрагментов: {job.segments}"
+                            )
+                finally:
+                    # Генератор нельзя закрыть, пока next() выполняется в пуле потоков (например, при отмене)
+                    if reading is not None and not reading.done():
+                        await asyncio.wait([asyncio.wrap_future(reading)])
+                    segments.close()
+                    if part is not None:
+                        part.close()
+
+                if part is not None:
+                    await self._send_part(bot, job, part_path, part_first, last_segment)
+            outcome = 'ok'
+            if not job.segments:
+                await self._progress(job, f"❌ {job.name}: в документе нет текста для озвучки.", keyboard=False)
+            elif job.truncated:
+                await self._progress(
+                    job, f"⚠️ {job.name}: озвучены первые {job.chars} символов (максимум {DOCUMENT_MAX_CHARS}).",
+                    keyboard=False
+                )
+            else:
+                await self._progress(job, f"✅ {job.name}: готово, частей: {job.parts}.", keyboard=False)
+        except asyncio.CancelledError:
+            outcome = 'cancelled'
+            await self._progress(job, f"⏹ {job.name}: озвучка отменена. Отправлено частей: {job.parts}.", keyboard=False)
+        except UpstreamUnavailable as e:
+            logger.warning("Озвучка документа недоступна: %s", e)
+            outcome = 'unavailable'
+            await self._progress(
+                job, f"⚠️ Сервис озвучки сейчас недоступен. Попробуйте через {e.retry_in:.0f} сек.", keyboard=False
+            )
+        except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as e:
+            logger.warning("Не удалось прочитать документ %s: %s", job.name, e)
+            await self._progress(job, f"❌ Не удалось прочитать документ {job.name}.", keyboard=False)
+        except Exception as e:
+            logger.exception("Ошибка при озвучке документа: %s", e)
+            metrics.ERRORS.inc(stage='document', type=type(e).__name__)
+            await self._progress(job, "❌ Произошла ошибка при озвучке документа. Попробуйте еще раз.", keyboard=False)
+        finally:
+            for _, task in pending:
+                task.cancel()
+            for path in (source_path, part_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    logger.warning("Не удалось удалить временный файл %s", path)
+            self.jobs.pop(job.user_id, None)
+            metrics.DOCUMENT_JOBS.inc(outcome=outcome)
+            logger.info("Документ user=%s name=%s chars=%d segments=%d parts=%d outcome=%s",
+                        job.user_id, job.name, job.chars, job.segments, job.parts, outcome)
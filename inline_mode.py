@@ -0,0 +1,215 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+from telegram import Bot, InlineQueryResultCachedAudio, InlineQueryResultCachedVoice, Update
+from telegram.error import TelegramError
+from telegram.ext import ContextTypes
+import config
+from voice import OUTPUT_PROFILE, get_output_profile
+from upstream import UpstreamUnavailable
+from concurrency import SingleFlight
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Чат (например, закрытый канал), куда загружаются клипы для inline-ответов.
+# None - inline-режим отвечает только уже загруженными клипами и ничего не синтезирует
+INLINE_CACHE_CHAT_ID = getattr(config, 'INLINE_CACHE_CHAT_ID', None)
+# Сколько первых голосов из get_default_voices предлагается в inline-ответе
+INLINE_VOICES = getattr(config, 'INLINE_VOICES', 5)
+# Частые фразы, которые озвучиваются и загружаются заранее (показываются при пустом запросе)
+INLINE_PHRASES = getattr(config, 'INLINE_PHRASES', [
+    "Привет!", "Спасибо!", "Доброе утро!", "Спокойной ночи!", "С днём рождения!", "Да", "Нет",
+])
+# Синтез начинается, только если пользователь не менял запрос столько секунд
+INLINE_DEBOUNCE = getattr(config, 'INLINE_DEBOUNCE', 0.8)
+# Сколько ждать синтеза перед ответом; недождавшиеся клипы догружаются в фоне для следующих запросов
+INLINE_ANSWER_TIMEOUT = getattr(config, 'INLINE_ANSWER_TIMEOUT', 6.0)
+# Сколько секунд Telegram может кэшировать полный ответ
+INLINE_CACHE_TIME = getattr(config, 'INLINE_CACHE_TIME', 300)
+
+# Inline-запрос Telegram не длиннее 256 символов
+INLINE_MAX_TEXT_LENGTH = 256
+# Очередь FairScheduler для заранее озвучиваемых фраз
+PRECOMPUTE_USER_ID = 0
+
+
+class InlineTTS:
+    """
+    Озвучка в inline-режиме (@bot текст).
+
+    Ответ собирается из file_id уже загруженных клипов, поэтому укладывается в таймаут
+    inline-запроса. Недостающие клипы синтезируются только для последнего запроса
+    пользователя (после паузы INLINE_DEBOUNCE) и загружаются в INLINE_CACHE_CHAT_ID.
+    """
+
+    def __init__(self, voice_manager, file_ids, scheduler, profile_for: Callable[[int], str]):
+        self.voice_manager = voice_manager
+        self.file_ids = file_ids
+        self.scheduler = scheduler
+        self.profile_for = profile_for
+        self._latest: Dict[int, str] = {}  # user_id -> id последнего inline-запроса
+        self._uploads = SingleFlight()
+        self._pending = set()  # загрузки, которые продолжаются после ответа
+
+    def voices(self) -> List[Dict]:
+        """Голоса, которые предлагаются в inline-ответе"""
+        return self.voice_manager.get_default_voices()[:INLINE_VOICES]
+
+    def _result(self, key: str, file_id: str, voice: Dict, profile: str, title: str = None):
+        title = title or voice.get('name', 'Voice')
+        if get_output_profile(profile)['voice_note']:
+            return InlineQueryResultCachedVoice(id=key, voice_file_id=file_id, title=title)
+        return InlineQueryResultCachedAudio(id=key, audio_file_id=file_id)
+
+    def _cached_results(self, text: str, voices: List[Dict], profile: str) -> List:
+        results = []
+        for voice in voices:
+            key = self.voice_manager.cache_key(text, voice['voice_id'], profile)
+            file_id = self.file_ids.get(key)
+            if file_id:
+                results.append(self._result(key, file_id, voice, profile))
+        return results
+
+    def _phrase_results(self) -> List:
+        """Заранее озвученные частые фразы первым голосом в формате OUTPUT_PROFILE (ответ на пустой запрос)"""
+        voices = self.voices()
+        if not voices:
+            return []
+        voice = voices[0]
+        results = []
+        for phrase in INLINE_PHRASES:
+            key = self.voice_manager.cache_key(phrase, voice['voice_id'], OUTPUT_PROFILE)
+            file_id = self.file_ids.get(key)
+            if file_id:
+                results.append(self._result(key, file_id, voice, OUTPUT_PROFILE, title=phrase))
+        return results
+
+    async def upload(self, bot: Bot, text: str, voice: Dict, profile: str, user_id: int) -> Optional[str]:
+        """
+        Возвращает file_id клипа, при необходимости озвучив его и загрузив в INLINE_CACHE_CHAT_ID
+
+        Args:
+            bot (Bot): Бот, от имени которого загружается клип
+            text (str): Текст для озвучки
+            voice (Dict): Голос из каталога
+            profile (str): Профиль вывода из OUTPUT_PROFILES
+            user_id (int): Чья очередь FairScheduler расходуется на синтез
+
+        Returns:
+            Optional[str]: file_id или None, если синтез не удался или очередь пользователя заполнена
+        """
+        key = self.voice_manager.cache_key(text, voice['voice_id'], profile)
+        file_id = self.file_ids.get(key)
+        if file_id:
+            return file_id
+        # Одновременные запросы одного клипа (например, от разных пользователей) загружают его один раз
+        return await self._uploads.do(key, lambda: self._synthesize_and_upload(bot, key, text, voice, profile, user_id))
+
+    async def _synthesize_and_upload(self, bot: Bot, key: str, text: str, voice: Dict, profile: str,
+                                     user_id: int) -> Optional[str]:
+        voice_name = voice.get('name', 'Voice')
+        if self.voice_manager.audio_cache.contains(key):
+            audio = await self.voice_manager.agenerate_audio_bytes(text, voice['voice_id'], profile)
+        else:
+            ticket = self.scheduler.enqueue(user_id, cost=len(text))
+            if ticket is None:
+                return None
+            async with ticket:
+                audio = await self.voice_manager.agenerate_audio_bytes(text, voice['voice_id'], profile)
+        if not audio:
+            return None
+
+        output = get_output_profile(profile)
+        filename = f"{voice_name}.{output['extension']}"
+        if output['voice_note']:
+            message = await bot.send_voice(
+                chat_id=INLINE_CACHE_CHAT_ID, voice=audio, filename=filename, disable_notification=True
+            )
+        else:
+            message = await bot.send_audio(
+                chat_id=INLINE_CACHE_CHAT_ID, audio=audio, filename=filename, title=voice_name,
+                performer="ElevenLabs TTS Bot", disable_notification=True
+            )
+        sent_file = message.voice or message.audio
+        self.file_ids.set(key, sent_file.file_id)
+        return sent_file.file_id
+
+    def _keep_running(self, task: asyncio.Future):
+        """Загрузка продолжается после ответа: следующий такой же запрос получит готовый клип"""
+        self._pending.add(task)
+        task.add_done_callback(self._upload_done)
+
+    def _upload_done(self, task: asyncio.Future):
+        self._pending.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error and not isinstance(error, UpstreamUnavailable):
+            logger.warning("Не удалось подготовить inline-клип: %s", error)
+            metrics.ERRORS.inc(stage='inline_upload', type=type(error).__name__)
+
+    async def handle(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик inline-запроса"""
+        query = update.inline_query
+        text = query.query.strip()[:INLINE_MAX_TEXT_LENGTH]
+        user_id = query.from_user.id
+        profile = self.profile_for(user_id)
+
+        if not text:
+            metrics.INLINE_QUERIES.inc(outcome='phrases')
+            await self._answer(query, self._phrase_results(), complete=True)
+            return
+
+        voices = self.voices()
+        results = self._cached_results(text, voices, profile)
+        if len(results) == len(voices) or INLINE_CACHE_CHAT_ID is None:
+            metrics.INLINE_QUERIES.inc(outcome='file_id')
+            await self._answer(query, results, complete=len(results) == len(voices))
+            return
+
+        # Клиент Telegram шлет запрос на каждое нажатие клавиши: озвучиваем только последний
+        self._latest[user_id] = query.id
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if self._latest.get(user_id) != query.id:
+            metrics.INLINE_QUERIES.inc(outcome='superseded')
+            return
+        del self._latest[user_id]
+
+        uploads = [
+            asyncio.ensure_future(self.upload(context.bot, text, voice, profile, user_id))
+            for voice in voices
+        ]
+        for task in uploads:
+            self._keep_running(task)
+        await asyncio.wait(uploads, timeout=INLINE_ANSWER_TIMEOUT)
+
+        results = self._cached_results(text, voices, profile)
+        metrics.INLINE_QUERIES.inc(outcome='ok' if results else 'error')
+        await self._answer(query, results, complete=len(results) == len(voices))
+
+    async def _answer(self, query, results: List, complete: bool):
+        try:
+            # Профиль вывода у каждого пользователя свой, поэтому ответ персональный;
+            # неполный ответ не кэшируется, чтобы повторный запрос получил догруженные клипы
+            await query.answer(results, cache_time=INLINE_CACHE_TIME if complete else 0, is_personal=True)
+        except TelegramError as e:
+            # Например, запрос устарел: пользователь уже набрал другой текст
+            logger.warning("Не удалось ответить на inline-запрос: %s", e)
+
+    async def precompute(self, bot: Bot):
+        """Фоновая задача: заранее озвучивает и загружает INLINE_PHRASES для популярных голосов"""
+        if INLINE_CACHE_CHAT_ID is None:
+            return
+        prepared = 0
+        for phrase in INLINE_PHRASES:
+            for voice in self.voices():
+                try:
+                    if await self.upload(bot, phrase, voice, OUTPUT_PROFILE, PRECOMPUTE_USER_ID):
+                        prepared += 1
+                except UpstreamUnavailable as e:
+                    logger.warning("Подготовка inline-фраз прервана: %s", e)
+                    return
+                except Exception as e:
+                    logger.warning("Не удалось подготовить inline-фразу %r: %s", phrase, e)
+        logger.info("Inline-фразы готовы: %d клипов", prepared)
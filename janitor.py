@@ -0,0 +1,129 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import config
+import metrics
+
+# Временные аудио файлы старше TEMP_FILE_MAX_AGE секунд удаляются; если их общий размер
+# больше TEMP_DIR_MAX_BYTES, удаляются самые старые. Файлы моложе TEMP_FILE_MIN_AGE не трогаются
+TEMP_FILE_MAX_AGE = getattr(config, 'TEMP_FILE_MAX_AGE', 3600)
+TEMP_DIR_MAX_BYTES = getattr(config, 'TEMP_DIR_MAX_BYTES', 200 * 1024 * 1024)
+TEMP_FILE_MIN_AGE = getattr(config, 'TEMP_FILE_MIN_AGE', 60)
+JANITOR_INTERVAL = getattr(config, 'JANITOR_INTERVAL', 300)
+
+# Уборка касается только временных файлов: файлы кэша (.audio) и журнал file_id не удаляются
+TEMP_FILE_SUFFIXES = ('.mp3', '.wav', '.ogg', '.tmp')
+
+
+class InUseFiles:
+    """Пути временных файлов, которые сейчас пишутся или загружаются в Telegram"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, int] = {}
+
+    @contextmanager
+    def hold(self, path: str):
+        """Помечает файл занятым на время блока (вложенные блоки допустимы)"""
+        path = os.path.abspath(path)
+        with self._lock:
+            self._counts[path] = self._counts.get(path, 0) + 1
+        try:
+            yield path
+        finally:
+            with self._lock:
+                count = self._counts.pop(path) - 1
+                if count:
+                    self._counts[path] = count
+
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            return os.path.abspath(path) in self._counts
+
+
+class TempJanitor:
+    """Удаляет брошенные временные аудио файлы по возрасту и бюджету размера папки"""
+
+    def __init__(self, directories: List[str], in_use: InUseFiles, max_age: float = TEMP_FILE_MAX_AGE,
+                 max_bytes: int = TEMP_DIR_MAX_BYTES, min_age: float = TEMP_FILE_MIN_AGE):
+        self.directories = directories
+        self.in_use = in_use
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+
+    def _candidates(self) -> List[Tuple[float, str, int]]:
+        files = []
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.name.endswith(TEMP_FILE_SUFFIXES):
+                    continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, entry.path, stat.st_size))
+        files.sort()
+        return files
+
+    def sweep(self, max_age: Optional[float] = None, min_age: Optional[float] = None) -> Tuple[int, int]:
+        """
+        Удаляет старые временные файлы и самые старые сверх бюджета, пропуская занятые
+
+        Args:
+            max_age (float, optional): Переопределяет возраст удаления (0 - удалить все свободные)
+            min_age (float, optional): Переопределяет минимальный возраст удаляемого файла
+
+        Returns:
+            Tuple[int, int]: Сколько файлов удалено и сколько байт освобождено
+        """
+        max_age = self.max_age if max_age is None else max_age
+        min_age = self.min_age if min_age is None else min_age
+        now = time.time()
+        files = self._candidates()
+        total = sum(size for _, _, size in files)
+
+        removed = 0
+        reclaimed = 0
+        for mtime, path, size in files:
+            age = now - mtime
+            if age <= max_age and total <= self.max_bytes:
+                # Файлы отсортированы от старых к новым: дальше удалять нечего
+                break
+            if age < min_age or path in self.in_use:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Не удалось удалить временный файл {path}: {e}")
+                continue
+            total -= size
+            removed += 1
+            reclaimed += size
+
+        metrics.JANITOR_RECLAIMED_BYTES.inc(reclaimed)
+        return removed, reclaimed
+
+    async def run(self, interval: float = JANITOR_INTERVAL):
+        """Фоновая задача: периодическая уборка в пуле потоков, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed, reclaimed = await loop.run_in_executor(None, self.sweep)
+            except Exception as e:
+                print(f"Ошибка при уборке временных файлов: {e}")
+                continue
+            if removed:
+                print(f"Удалено временных файлов: {removed}, освобождено {reclaimed / 1024 / 1024:.1f} МБ")
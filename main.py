@@ -1,10 +1,28 @@
 # telegram_tts_bot.py
+import time
+# Отсчет времени запуска, включая импорт зависимостей
+STARTED_AT = time.perf_counter()
+
+import asyncio
 import logging
 import os
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+import sys
+from typing import Dict
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import Application, BaseUpdateProcessor, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, ContextTypes, filters
 import config
-from voice import VoiceManager
+from voice import (
+    VoiceManager, AUDIO_DELIVERY_MODE, MAX_LONG_TEXT_LENGTH, OUTPUT_PROFILE, OUTPUT_PROFILES,
+    PROGRESSIVE_DELIVERY, PROGRESSIVE_MIN_CHARS, TTS_MAX_CONCURRENCY, get_output_profile,
+)
+from upstream import UpstreamUnavailable
+from audio_cache import AUDIO_CACHE_MAX_BYTES, FileIdStore
+from concurrency import FairScheduler
+from state_store import UserStateStore
+from inline_mode import InlineTTS
+from documents import DocumentJobs
+import metrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -13,12 +31,117 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Сколько апдейтов Telegram обрабатывается параллельно (синтез одного текста не блокирует остальных);
+# апдейты одного пользователя обрабатываются по очереди
+CONCURRENT_UPDATES = getattr(config, 'CONCURRENT_UPDATES', 64)
+
+# Ограничения тарифа ElevenLabs: одновременные запросы и символы в минуту (0 - без лимита),
+# а также сколько текстов один пользователь может держать в очереди
+ELEVENLABS_MAX_CONCURRENCY = getattr(config, 'ELEVENLABS_MAX_CONCURRENCY', TTS_MAX_CONCURRENCY)
+ELEVENLABS_CHARS_PER_MINUTE = getattr(config, 'ELEVENLABS_CHARS_PER_MINUTE', 0)
+MAX_PENDING_PER_USER = getattr(config, 'MAX_PENDING_PER_USER', 10)
+
+# Сколько голосов показывать на одной странице выбора
+VOICES_PER_PAGE = 10
+
+# Получение апдейтов: 'polling' или 'webhook' (нужен python-telegram-bot[webhooks])
+BOT_MODE = getattr(config, 'BOT_MODE', 'polling')
+WEBHOOK_LISTEN = getattr(config, 'WEBHOOK_LISTEN', '127.0.0.1')
+WEBHOOK_PORT = getattr(config, 'WEBHOOK_PORT', 8443)
+WEBHOOK_PATH = getattr(config, 'WEBHOOK_PATH', 'telegram')
+# Публичный HTTPS адрес, который регистрируется в Telegram (обязателен в режиме webhook)
+WEBHOOK_URL = getattr(config, 'WEBHOOK_URL', None)
+WEBHOOK_SECRET_TOKEN = getattr(config, 'WEBHOOK_SECRET_TOKEN', None)
+# Адрес Bot API (None - api.telegram.org)
+TELEGRAM_API_BASE_URL = getattr(config, 'TELEGRAM_API_BASE_URL', None)
+
+# Прогрев до начала приема апдейтов: SDK ElevenLabs, индекс кэша, каталог голосов и
+# WARMUP_CONNECTIONS соединений к ElevenLabs. False - бот начинает работу сразу, а ресурсы
+# создаются при первых запросах
+STARTUP_WARMUP = getattr(config, 'STARTUP_WARMUP', True)
+WARMUP_CONNECTIONS = getattr(config, 'WARMUP_CONNECTIONS', 4)
+
+# Сколько процессов-воркеров обрабатывают апдейты (больше 1 - многопроцессный режим, только polling)
+BOT_WORKERS = getattr(config, 'BOT_WORKERS', 1)
+
+# Бот обрабатывает только сообщения, нажатия inline-кнопок и inline-запросы (@bot текст)
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Сообщения и нажатия кнопок одного пользователя обрабатываются строго по очереди,
+    апдейты разных пользователей - параллельно, не больше limit одновременно.
+    Inline-запросы не упорядочиваются: устаревшие из них отбрасываются по INLINE_DEBOUNCE.
+    """
+
+    def __init__(self, limit: int):
+        # Семафор BaseUpdateProcessor берется до очереди пользователя, поэтому лимит проверяется
+        # здесь: апдейты, ждущие предыдущих апдейтов своего пользователя, не занимают слоты
+        super().__init__(sys.maxsize)
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}  # user_id -> апдейты в обработке и в очереди
+
+    @staticmethod
+    def _user_id(update: object):
+        if isinstance(update, Update) and (update.message or update.callback_query) and update.effective_user:
+            return update.effective_user.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        user_id = self._user_id(update)
+        if user_id is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        # asyncio.Lock пропускает ожидающих в порядке очереди, а задачи апдейтов создаются по порядку
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._waiting[user_id] = self._waiting.get(user_id, 0) + 1
+        try:
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            self._waiting[user_id] -= 1
+            if not self._waiting[user_id]:
+                del self._waiting[user_id]
+                del self._locks[user_id]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
 class TelegramTTSBot:
     """Телеграм бот для преобразования текста в речь"""
 
-    def __init__(self):
-        self.voice_manager = VoiceManager()
-        self.user_states = {}  # Хранение состояний пользователей
+    def __init__(self, worker_index: int = 0, workers: int = 1):
+        init_started = time.perf_counter()
+        # Длительность этапов запуска для лога и метрики tts_startup_seconds
+        self.startup = {'import': init_started - STARTED_AT}
+        # В многопроцессном режиме лимиты ElevenLabs и бюджет общего кэша аудио делятся между воркерами
+        self.worker_index = worker_index
+        self.voice_manager = VoiceManager(cache_max_bytes=AUDIO_CACHE_MAX_BYTES // workers)
+        self.user_store = UserStateStore()  # Выбранный голос пользователей (переживает перезапуск)
+        self.user_formats = UserStateStore(field='format')  # Выбранный профиль вывода (mp3_128, opus_32, ...)
+        self._background_tasks = []
+        self._metrics_server = None
+        self.file_ids = FileIdStore()  # file_id уже загруженных в Telegram клипов
+        # Очередь запросов к ElevenLabs: пользователи обслуживаются по кругу, общий лимит на тариф
+        self.scheduler = FairScheduler(
+            max_concurrency=max(1, ELEVENLABS_MAX_CONCURRENCY // workers),
+            chars_per_minute=ELEVENLABS_CHARS_PER_MINUTE // workers,
+            max_pending_per_user=MAX_PENDING_PER_USER,
+        )
+        # Inline-режим: ответы из уже загруженных клипов, синтез только последнего запроса
+        self.inline = InlineTTS(self.voice_manager, self.file_ids, self.scheduler, self._user_profile)
+        # Озвучка присланных документов (.txt, .docx, .srt) фоновыми задачами
+        self.documents = DocumentJobs(self.voice_manager, self.scheduler)
+        metrics.REGISTRY.set_callback('tts_queue_length', 'gauge', 'Запросы, ожидающие в очереди', lambda: self.scheduler.queued)
+        metrics.REGISTRY.set_callback('tts_active_synthesis', 'gauge', 'Запросы, получившие слот синтеза', lambda: self.scheduler.active)
 
         # Постоянная клавиатура снизу (показывается над строкой ввода)
         # reply_markup для send_message / reply_text - ReplyKeyboardMarkup закрепляется под полем ввода
@@ -27,11 +150,12 @@ class TelegramTTSBot:
             resize_keyboard=True,
             one_time_keyboard=False,
         )
+        self.startup['init'] = time.perf_counter() - init_started
 
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user_id = update.effective_user.id
-        self.user_states[user_id] = {'waiting_for_text': False, 'selected_voice': None}
+        self.user_store.set(user_id, None)
 
         welcome_text = (
             "🎤 Добро пожаловать в Text-to-Speech бот!\n\n"
@@ -39,7 +163,7 @@ class TelegramTTSBot:
             "Как пользоваться:\n"
             "• Нажмите '🎭 Выбрать голос' и выберите подходящий голос.\n"
             "• Отправьте текст (до {} символов).\n"
-            "• Получите mp3 с озвучкой.".format(config.MAX_TEXT_LENGTH)
+            "• Получите mp3 с озвучкой.".format(MAX_LONG_TEXT_LENGTH)
         )
 
         # Если пришло из callback_query — ответим немного иначе
@@ -58,7 +182,9 @@ class TelegramTTSBot:
             "1. Нажмите '🎭 Выбрать голос' или используйте команду /voices\n"
             "2. Отправьте текст для озвучки\n"
             "3. Получите аудио файл с озвучкой\n\n"
-            f"⚠️ Максимальная длина текста: {config.MAX_TEXT_LENGTH} символов"
+            "Формат озвучки (mp3 или голосовое сообщение) можно сменить командой /format\n\n"
+            "Можно прислать документ .txt, .docx или субтитры .srt - озвучка придет частями\n\n"
+            f"⚠️ Максимальная длина текста: {MAX_LONG_TEXT_LENGTH} символов"
         )
         await update.effective_message.reply_text(help_text, reply_markup=self.bottom_keyboard)
 
@@ -66,8 +192,36 @@ class TelegramTTSBot:
         """Обработчик команды /voices"""
         await self.show_voice_selection(update, context)
 
-    async def show_voice_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Показать inline-клавиатуру для выбора голоса"""
+    async def format_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработчик команды /format: выбор профиля вывода"""
+        current = self._user_profile(update.effective_user.id)
+        keyboard = [
+            [InlineKeyboardButton(("✅ " if name == current else "") + profile['label'], callback_data=f"format_{name}")]
+            for name, profile in OUTPUT_PROFILES.items()
+        ]
+        await update.effective_message.reply_text(
+            "🎚 Выберите формат озвучки. Голосовые сообщения (Opus) и mp3 с низким битрейтом "
+            "загружаются быстрее:",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+
+    async def handle_format_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка выбора профиля вывода (callback data format_{name})"""
+        query = update.callback_query
+        name = query.data.split("_", 1)[1]
+        if name not in OUTPUT_PROFILES:
+            await query.edit_message_text("❌ Неизвестный формат.")
+            return
+        self.user_formats.set(update.effective_user.id, None if name == OUTPUT_PROFILE else name)
+        await query.edit_message_text(f"✅ Формат озвучки: *{OUTPUT_PROFILES[name]['label']}*", parse_mode='Markdown')
+
+    def _user_profile(self, user_id: int) -> str:
+        """Профиль вывода пользователя (по умолчанию OUTPUT_PROFILE)"""
+        name = self.user_formats.get(user_id)
+        return name if name in OUTPUT_PROFILES else OUTPUT_PROFILE
+
+    async def show_voice_selection(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
+        """Показать inline-клавиатуру для выбора голоса (страница page из кэшированного каталога)"""
         try:
             voices = self.voice_manager.get_voices()
 
@@ -75,16 +229,24 @@ class TelegramTTSBot:
                 await update.effective_message.reply_text("❌ Не удалось загрузить список голосов. Попробуйте позже.", reply_markup=self.bottom_keyboard)
                 return
 
-            # Создаем inline клавиатуру с голосами (первые 10)
+            pages = (len(voices) + VOICES_PER_PAGE - 1) // VOICES_PER_PAGE
+            page = max(0, min(page, pages - 1))
+
+            # Создаем inline клавиатуру с голосами текущей страницы
             keyboard = []
-            for i, voice in enumerate(voices[:10]):
+            for voice in voices[page * VOICES_PER_PAGE:(page + 1) * VOICES_PER_PAGE]:
                 voice_name = voice.get('name', 'Unknown')
                 voice_id = voice.get('voice_id') or voice.get('id')
                 button_text = f"🎤 {voice_name}"
                 keyboard.append([InlineKeyboardButton(button_text, callback_data=f"voice_{voice_id}")])
 
-            if len(voices) > 10:
-                keyboard.append([InlineKeyboardButton("📄 Показать еще", callback_data="more_voices")])
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"more_voices_{page - 1}"))
+            if page < pages - 1:
+                navigation.append(InlineKeyboardButton("📄 Показать еще", callback_data=f"more_voices_{page + 1}"))
+            if navigation:
+                keyboard.append(navigation)
 
             # Кнопка главного меню теперь вызывает start
             keyboard.append([InlineKeyboardButton("🏠 Главное меню", callback_data="back_to_main")])
@@ -94,7 +256,8 @@ class TelegramTTSBot:
             message_text = (
                 "🎭 Выберите голос для озвучки:\n\n"
                 f"Найдено голосов: {len(voices)}\n"
-                "Выберите один из предложенных вариантов:"
+                + (f"Страница {page + 1} из {pages}\n" if pages > 1 else "")
+                + "Выберите один из предложенных вариантов:"
             )
 
             if update.callback_query:
@@ -114,12 +277,10 @@ class TelegramTTSBot:
         voice_id = query.data.split("_", 1)[1]
 
         try:
-            voices = self.voice_manager.get_voices()
-            selected_voice = next((v for v in voices if (v.get('voice_id') or v.get('id')) == voice_id), None)
+            selected_voice = self.voice_manager.get_voice_by_id(voice_id)
 
             if selected_voice:
-                self.user_states.setdefault(user_id, {'waiting_for_text': False, 'selected_voice': None})
-                self.user_states[user_id]['selected_voice'] = selected_voice
+                self.user_store.set(user_id, voice_id)
 
                 success_text = (
                     f"✅ Выбран голос: *{selected_voice.get('name', 'Unknown')}*\n\n"
@@ -151,10 +312,14 @@ class TelegramTTSBot:
             await self.start_command(update, context)
         elif query.data.startswith("voice_"):
             await self.handle_voice_selection(update, context)
-        elif query.data == "more_voices":
-            # В этом простом примере — просто сообщение. Можно реализовать пагинацию.
-            await query.edit_message_text("🚧 Пагинация пока не реализована. Показываю первые 10 голосов.")
-            await self.show_voice_selection(update, context)
+        elif query.data == self.documents.CANCEL_CALLBACK:
+            await self.documents.cancel(update, context)
+        elif query.data.startswith("format_"):
+            await self.handle_format_selection(update, context)
+        elif query.data.startswith("more_voices"):
+            # more_voices_{page}; старые кнопки без номера ведут на вторую страницу
+            page = query.data.rsplit("_", 1)[1]
+            await self.show_voice_selection(update, context, page=int(page) if page.isdigit() else 1)
 
     async def show_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать справку через inline кнопку"""
@@ -163,7 +328,7 @@ class TelegramTTSBot:
             "1. Выберите голос\n"
             "2. Отправьте текст для озвучки\n"
             "3. Получите аудио файл с озвучкой\n\n"
-            f"⚠️ Максимальная длина текста: {config.MAX_TEXT_LENGTH}"
+            f"⚠️ Максимальная длина текста: {MAX_LONG_TEXT_LENGTH}"
         )
 
         keyboard = [
@@ -177,10 +342,6 @@ class TelegramTTSBot:
         """Обработка текстовых сообщений и нажатий persistent-клавиатуры"""
         user_id = update.effective_user.id
 
-        # Инициализируем состояние пользователя если его нет
-        if user_id not in self.user_states:
-            self.user_states[user_id] = {'waiting_for_text': False, 'selected_voice': None}
-
         text = update.message.text.strip()
 
         # Обработка persistent keyboard нажатий
@@ -192,53 +353,170 @@ class TelegramTTSBot:
             return
 
         # Проверяем длину текста
-        if len(text) > config.MAX_TEXT_LENGTH:
+        if len(text) > MAX_LONG_TEXT_LENGTH:
             await update.message.reply_text(
-                f"❌ Текст слишком длинный! Максимум {config.MAX_TEXT_LENGTH} символов.\nВаш текст: {len(text)} символов.",
+                f"❌ Текст слишком длинный! Максимум {MAX_LONG_TEXT_LENGTH} символов.\nВаш текст: {len(text)} символов.",
                 reply_markup=self.bottom_keyboard
             )
             return
 
         # Проверяем, выбран ли голос
-        if not self.user_states[user_id]['selected_voice']:
+        selected_voice = self.voice_manager.get_voice_by_id(self.user_store.get(user_id))
+        if not selected_voice:
             await update.message.reply_text(
                 "❌ Сначала выберите голос командой /voices или кнопкой ниже:",
                 reply_markup=self.bottom_keyboard
             )
             return
 
-        # Отправляем сообщение о начале обработки
-        processing_message = await update.message.reply_text("🎤 Обрабатываю ваш текст...", reply_markup=self.bottom_keyboard)
+        voice_id = selected_voice.get('voice_id') or selected_voice.get('id')
+        voice_name = selected_voice.get('name', 'Voice')
+        profile = self._user_profile(user_id)
+        audio_options = dict(
+            chat_id=update.effective_chat.id,
+            title=f"Озвучка: {voice_name}",
+            performer="ElevenLabs TTS Bot",
+            caption=f"🎤 Озвучено голосом: *{voice_name}*\n📝 {text[:500]}{'...' if len(text) > 500 else ''}",
+            parse_mode='Markdown',
+        )
+        cache_key = self.voice_manager.cache_key(text, voice_id, profile)
+        timer = metrics.StageTimer(voice_id)
 
-        try:
-            selected_voice = self.user_states[user_id]['selected_voice']
-            voice_id = selected_voice.get('voice_id') or selected_voice.get('id')
-
-            # генерируем имя файла безопасно
-            safe_filename = f"user_{user_id}_{processing_message.message_id}.mp3"
-            audio_path = self.voice_manager.generate_audio(
-                text=text,
-                voice_id=voice_id,
-                output_filename=safe_filename
-            )
+        # Этот клип уже загружался в Telegram - отправляем по file_id без синтеза и загрузки
+        file_id = self.file_ids.get(cache_key)
+        if file_id:
+            try:
+                with timer.stage('upload'):
+                    await self._send_clip(context, file_id, profile, voice_name, audio_options)
+            except BadRequest as e:
+                logger.warning("Telegram не принял file_id %s: %s", file_id, e)
+                metrics.ERRORS.inc(stage='upload', type='StaleFileId')
+                self.file_ids.discard(cache_key)
+            except TelegramError as e:
+                # Сбой сети или таймаут: file_id исправен, но клип озвучивается и отправляется обычным путем
+                logger.warning("Не удалось отправить клип по file_id %s: %s", file_id, e)
+                metrics.ERRORS.inc(stage='upload', type=type(e).__name__)
+            else:
+                logger.info("Озвучка voice=%s chars=%d outcome=file_id %s", voice_id, len(text), timer.finish('file_id'))
+                try:
+                    await update.effective_message.reply_text("Готово! Можете отправить следующий текст.", reply_markup=self.bottom_keyboard)
+                except TelegramError as e:
+                    logger.warning("Не удалось отправить сообщение о готовности: %s", e)
+                return
+
+        # Запросы к ElevenLabs проходят через очередь; фразы из кэша отдаются сразу.
+        # Длинный текст не занимает слот целиком: каждый его фрагмент получает свой слот и списывает свои символы
+        ticket = None
+        chunk_slot = lambda cost: self.scheduler.slot(user_id, cost)
+        # Прогрессивно отправляются и тексты короче MAX_TEXT_LENGTH, если их озвучки еще нет в кэше.
+        # Повтор текста, уже отправленного по частям, склеивается из фрагментов в кэше в один клип,
+        # и его file_id запоминается для следующих повторов
+        short_progressive = PROGRESSIVE_DELIVERY and PROGRESSIVE_MIN_CHARS < len(text) <= config.MAX_TEXT_LENGTH
+        from_chunks = short_progressive and not self.voice_manager.audio_cache.contains(cache_key) and (
+            self.voice_manager.progressive_cached(text, voice_id, profile)
+        )
+        progressive = PROGRESSIVE_DELIVERY and len(text) > PROGRESSIVE_MIN_CHARS and (
+            len(text) > config.MAX_TEXT_LENGTH or not (from_chunks or self.voice_manager.audio_cache.contains(cache_key))
+        )
+        chunked = progressive or from_chunks or len(text) > config.MAX_TEXT_LENGTH
+        if chunked:
+            if self.scheduler.pending(user_id) >= MAX_PENDING_PER_USER:
+                metrics.REQUESTS.inc(voice=voice_id, outcome='throttled')
+                await update.message.reply_text(
+                    "⏳ У вас слишком много текстов в очереди. Дождитесь озвучки предыдущих.",
+                    reply_markup=self.bottom_keyboard
+                )
+                return
+        elif not self.voice_manager.audio_cache.contains(cache_key):
+            ticket = self.scheduler.enqueue(user_id, cost=len(text))
+            if ticket is None:
+                metrics.REQUESTS.inc(voice=voice_id, outcome='throttled')
+                await update.message.reply_text(
+                    "⏳ У вас слишком много текстов в очереди. Дождитесь озвучки предыдущих.",
+                    reply_markup=self.bottom_keyboard
+                )
+                return
 
-            if audio_path and os.path.exists(audio_path):
-                # Отправляем аудио файл
-                with open(audio_path, 'rb') as audio_file:
-                    await context.bot.send_audio(
-                        chat_id=update.effective_chat.id,
-                        audio=audio_file,
-                        title=f"Озвучка: {selected_voice.get('name', 'Voice')}",
-                        performer="ElevenLabs TTS Bot",
-                        caption=f"🎤 Озвучено голосом: *{selected_voice.get('name', 'Voice')}*\n📝 {text[:500]}{'...' if len(text) > 500 else ''}",
-                        parse_mode='Markdown',
+        # Отправляем сообщение о начале обработки (или о месте в очереди)
+        if ticket and ticket.position:
+            placeholder = f"⏳ Ваш текст в очереди, позиция: {ticket.position}"
+        else:
+            placeholder = "🎤 Обрабатываю ваш текст..."
+        try:
+            processing_message = await update.message.reply_text(placeholder, reply_markup=self.bottom_keyboard)
+        except Exception:
+            if ticket:
+                ticket.cancel()
+            raise
+
+        outcome = 'error'
+        metrics.IN_FLIGHT.inc()
+        try:
+            sent_message = None
+            if progressive:
+                # Начало озвучки приходит сразу, остальные части - следом по мере готовности
+                sent_message = await self._run_scheduled(
+                    ticket, processing_message, timer,
+                    lambda: self._send_progressive(context, processing_message, text, voice_id, voice_name, profile, audio_options, timer, chunk_slot)
+                )
+                cache_key = None
+            elif chunked:
+                # Длинный текст озвучивается по фрагментам и приходит одним файлом или серией частей
+                parts = await self._run_scheduled(
+                    ticket, processing_message, timer,
+                    lambda: self.voice_manager.agenerate_long_audio(
+                        text=text, voice_id=voice_id, profile=profile, slot=chunk_slot, progressive=from_chunks
+                    )
+                )
+                if parts:
+                    with timer.stage('upload'):
+                        sent_message = await self._send_audio_parts(context, parts, voice_name, profile, audio_options)
+                    if len(parts) > 1:
+                        # file_id последней части не соответствует всему тексту
+                        cache_key = None
+            elif AUDIO_DELIVERY_MODE == 'memory':
+                # Аудио собирается в памяти и загружается без временного файла
+                audio_data = await self._run_scheduled(
+                    ticket, processing_message, timer,
+                    lambda: self.voice_manager.agenerate_audio_bytes(text=text, voice_id=voice_id, profile=profile)
+                )
+                if audio_data:
+                    with timer.stage('upload'):
+                        sent_message = await self._send_clip(context, audio_data, profile, voice_name, audio_options)
+            else:
+                # генерируем имя файла безопасно
+                safe_filename = f"user_{user_id}_{processing_message.message_id}.{get_output_profile(profile)['extension']}"
+                # Файл занят до удаления: фоновая уборка его не тронет
+                with self.voice_manager.temp_files.hold(os.path.join(config.TEMP_AUDIO_DIR, safe_filename)):
+                    audio_path = await self._run_scheduled(
+                        ticket, processing_message, timer,
+                        lambda: self.voice_manager.agenerate_audio(
+                            text=text,
+                            voice_id=voice_id,
+                            output_filename=safe_filename,
+                            profile=profile
+                        )
                     )
 
-                # Удаляем временный файл
-                try:
-                    os.remove(audio_path)
-                except Exception:
-                    logger.warning("Не удалось удалить временный файл %s", audio_path)
+                    if audio_path and os.path.exists(audio_path):
+                        # Отправляем аудио файл
+                        with open(audio_path, 'rb') as audio_file, timer.stage('upload'):
+                            sent_message = await self._send_clip(context, audio_file, profile, voice_name, audio_options)
+
+                        # Удаляем временный файл
+                        try:
+                            os.remove(audio_path)
+                        except Exception:
+                            logger.warning("Не удалось удалить временный файл %s", audio_path)
+
+            if sent_message:
+                outcome = 'ok' if ticket or (chunked and not from_chunks) else 'cached'
+                if 'first_audio' not in timer.stages:
+                    timer.mark('first_audio')
+                # Запоминаем file_id, чтобы повторы отправлять без загрузки
+                sent_file = sent_message.voice or sent_message.audio
+                if cache_key and sent_file:
+                    self.file_ids.set(cache_key, sent_file.file_id)
 
                 # Удаляем сообщение о обработке
                 try:
@@ -250,28 +528,204 @@ class TelegramTTSBot:
                 await update.effective_message.reply_text("Готово! Можете отправить следующий текст.", reply_markup=self.bottom_keyboard)
             else:
                 await processing_message.edit_text("❌ Ошибка при генерации аудио. Попробуйте еще раз.", reply_markup=self.bottom_keyboard)
+        except UpstreamUnavailable as e:
+            # ElevenLabs не отвечает: не держим пользователя в ожидании таймаутов
+            logger.warning("Озвучка недоступна: %s", e)
+            outcome = 'unavailable'
+            try:
+                await processing_message.edit_text(f"⚠️ Сервис озвучки сейчас недоступен. Попробуйте через {e.retry_in:.0f} сек.")
+            except Exception:
+                pass
         except Exception as e:
             logger.exception("Ошибка при обработке текста: %s", e)
+            metrics.ERRORS.inc(stage='handler', type=type(e).__name__)
             try:
                 await processing_message.edit_text("❌ Произошла ошибка при обработке текста. Попробуйте еще раз.", reply_markup=self.bottom_keyboard)
             except Exception:
                 pass
+        finally:
+            if ticket:
+                ticket.cancel()
+            metrics.IN_FLIGHT.dec()
+            logger.info("Озвучка voice=%s chars=%d outcome=%s %s", voice_id, len(text), outcome, timer.finish(outcome))
+
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка присланных документов: озвучка в фоне с прогрессом и кнопкой отмены"""
+        user_id = update.effective_user.id
+        selected_voice = self.voice_manager.get_voice_by_id(self.user_store.get(user_id))
+        if not selected_voice:
+            await update.message.reply_text(
+                "❌ Сначала выберите голос командой /voices или кнопкой ниже:",
+                reply_markup=self.bottom_keyboard
+            )
+            return
 
-    def run(self):
-        """Запуск бота"""
-        # Создаем приложение
-        application = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+        voice_id = selected_voice.get('voice_id') or selected_voice.get('id')
+        await self.documents.start(update, context, voice_id, selected_voice.get('name', 'Voice'), self._user_profile(user_id))
+
+    async def _run_scheduled(self, ticket, processing_message, timer, synthesize):
+        """Выполняет синтез, дождавшись своей очереди (если запрос стоит в очереди)"""
+        if ticket is None:
+            return await synthesize()
+        async with ticket:
+            timer.record('queue_wait', ticket.wait_time)
+            if ticket.position:
+                try:
+                    await processing_message.edit_text("🎤 Обрабатываю ваш текст...")
+                except Exception:
+                    pass
+            return await synthesize()
+
+    async def _send_clip(self, context: ContextTypes.DEFAULT_TYPE, clip, profile: str, name: str, audio_options: dict):
+        """Отправляет клип аудио файлом или голосовым сообщением (Opus) в зависимости от профиля"""
+        output = get_output_profile(profile)
+        filename = f"{name}.{output['extension']}"
+        if output['voice_note']:
+            # У голосовых сообщений нет названия и исполнителя
+            options = {key: value for key, value in audio_options.items() if key not in ('title', 'performer')}
+            return await context.bot.send_voice(voice=clip, filename=filename, **options)
+        return await context.bot.send_audio(audio=clip, filename=filename, **audio_options)
+
+    async def _send_audio_parts(self, context: ContextTypes.DEFAULT_TYPE, parts, voice_name: str, profile: str, audio_options: dict):
+        """Отправляет озвучку длинного текста: один файл или пронумерованную серию"""
+        if len(parts) == 1:
+            return await self._send_clip(context, parts[0], profile, voice_name, audio_options)
+
+        sent_message = None
+        for number, part in enumerate(parts, start=1):
+            options = dict(audio_options)
+            options['title'] = f"{audio_options['title']} ({number}/{len(parts)})"
+            if number > 1:
+                options['caption'] = f"🎤 Часть {number}/{len(parts)}"
+            sent_message = await self._send_clip(context, part, profile, f"{voice_name}_{number:02d}", options)
+        return sent_message
+
+    async def _send_progressive(self, context: ContextTypes.DEFAULT_TYPE, processing_message, text: str, voice_id: str,
+                                voice_name: str, profile: str, audio_options: dict, timer, slot=None):
+        """Отправляет части прогрессивной озвучки длинного текста по мере их готовности"""
+        sent_message = None
+        number = 0
+        async for part in self.voice_manager.astream_long_audio(text, voice_id, profile, slot):
+            number += 1
+            options = dict(audio_options)
+            options['title'] = f"{audio_options['title']} (часть {number})"
+            if number > 1:
+                options['caption'] = f"🎤 Часть {number}"
+            with timer.stage('upload'):
+                sent_message = await self._send_clip(context, part, profile, f"{voice_name}_{number:02d}", options)
+            if number == 1:
+                timer.mark('first_audio')
+                try:
+                    await processing_message.edit_text("🎤 Озвучиваю продолжение...")
+                except Exception:
+                    pass
+        return sent_message
+
+    async def post_init(self, application: Application):
+        """Запуск фоновых задач после инициализации приложения"""
+        try:
+            # Каждый воркер отдает метрики на своем порту: METRICS_PORT + номер воркера
+            port = metrics.METRICS_PORT + self.worker_index if metrics.METRICS_PORT else None
+            self._metrics_server = metrics.start_metrics_server(port=port)
+        except OSError as e:
+            logger.warning("Не удалось запустить endpoint метрик: %s", e)
+
+        loop = asyncio.get_running_loop()
+        warmup_started = time.perf_counter()
+        if STARTUP_WARMUP:
+            # Первые пользователи не ждут импорта SDK, TLS-рукопожатий и загрузки каталога голосов
+            steps = await loop.run_in_executor(None, self.voice_manager.warm_up, WARMUP_CONNECTIONS)
+            logger.info("Прогрев: %s", ' '.join(f"{step}={seconds:.3f}s" for step, seconds in steps.items()))
+        else:
+            # Каталог загружается в фоне; до загрузки используются голоса по умолчанию
+            self._background_tasks.append(loop.run_in_executor(None, self.voice_manager.catalog.refresh))
+        self.startup['warmup'] = time.perf_counter() - warmup_started
+        self._background_tasks.append(asyncio.create_task(self.voice_manager.catalog.run_refresher()))
+        self._background_tasks.append(asyncio.create_task(self.user_store.run_flusher()))
+        self._background_tasks.append(asyncio.create_task(self.user_formats.run_flusher()))
+        self._background_tasks.append(asyncio.create_task(self.voice_manager.janitor.run()))
+        if self.worker_index == 0:
+            # Журнал file_id общий, поэтому частые фразы готовит только первый воркер
+            self._background_tasks.append(asyncio.create_task(self.inline.precompute(application.bot)))
+
+        # post_init выполняется перед началом приема апдейтов
+        self.startup['ready'] = time.perf_counter() - STARTED_AT
+        for phase, seconds in self.startup.items():
+            metrics.STARTUP_SECONDS.set(seconds, phase=phase)
+        logger.info("Бот готов к работе за %.2f с: %s", self.startup['ready'],
+                    ' '.join(f"{phase}={seconds:.3f}s" for phase, seconds in self.startup.items()))
+
+    async def post_shutdown(self, application: Application):
+        """Остановка фоновых задач и сохранение состояния"""
+        for task in self._background_tasks:
+            task.cancel()
+        self.documents.cancel_all()
+        if self._metrics_server:
+            self._metrics_server.shutdown()
+        self.user_store.close()
+        self.user_formats.close()
+
+    def build_application(self) -> Application:
+        """Создает приложение Telegram с обработчиками бота"""
+        builder = (
+            Application.builder()
+            .token(config.TELEGRAM_BOT_TOKEN)
+            .concurrent_updates(UserOrderedUpdateProcessor(CONCURRENT_UPDATES))
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+        )
+        if TELEGRAM_API_BASE_URL:
+            # Например, локальный fake-сервер из tools/fake_telegram.py
+            base_url = TELEGRAM_API_BASE_URL.rstrip('/')
+            builder = builder.base_url(f"{base_url}/bot").base_file_url(f"{base_url}/file/bot")
+        application = builder.build()
 
         # Добавляем обработчики
         application.add_handler(CommandHandler("start", self.start_command))
         application.add_handler(CommandHandler("help", self.help_command))
         application.add_handler(CommandHandler("voices", self.voices_command))
+        application.add_handler(CommandHandler("format", self.format_command))
         application.add_handler(CallbackQueryHandler(self.handle_callback_query))
+        application.add_handler(InlineQueryHandler(self.inline.handle))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text_message))
+        application.add_handler(MessageHandler(filters.Document.ALL, self.handle_document))
+        return application
+
+    def run(self):
+        """Запуск бота"""
+        if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+            # Без него PTB зарегистрирует в Telegram локальный адрес WEBHOOK_LISTEN:WEBHOOK_PORT
+            raise ValueError("В режиме webhook задайте WEBHOOK_URL - публичный HTTPS адрес бота")
+
+        # Создаем приложение
+        application = self.build_application()
 
         # Запускаем бота
-        logger.info("Запуск бота...")
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if BOT_MODE == 'webhook':
+            webhook_url = f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}"
+            logger.info("Запуск бота в режиме webhook на %s:%s/%s...", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=webhook_url,
+                secret_token=WEBHOOK_SECRET_TOKEN or None,
+                allowed_updates=ALLOWED_UPDATES,
+            )
+        else:
+            logger.info("Запуск бота...")
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+def run_workers(workers: int):
+    """Запуск в многопроцессном режиме: супервизор получает апдейты и раздает их воркерам"""
+    if BOT_MODE == 'webhook':
+        raise ValueError("BOT_WORKERS > 1 поддерживается только в режиме polling")
+    from supervisor import run_supervisor
+    options = {}
+    if TELEGRAM_API_BASE_URL:
+        base_url = TELEGRAM_API_BASE_URL.rstrip('/')
+        options = dict(base_url=f"{base_url}/bot", base_file_url=f"{base_url}/file/bot")
+    run_supervisor(workers, Bot(config.TELEGRAM_BOT_TOKEN, **options), ALLOWED_UPDATES)
 
 
 def main():
@@ -286,6 +740,10 @@ def main():
             print("❌ Ошибка: Не установлен API ключ ElevenLabs в config.py")
             return
 
+        if BOT_WORKERS > 1:
+            run_workers(BOT_WORKERS)
+            return
+
         # Создаем и запускаем бота
         bot = TelegramTTSBot()
         bot.run()
@@ -0,0 +1,244 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import config
+
+# Локальный HTTP endpoint с метриками в формате Prometheus (None - не запускать)
+METRICS_LISTEN = getattr(config, 'METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = getattr(config, 'METRICS_PORT', 9108)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Монотонный счетчик с метками"""
+
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться"""
+
+    kind = 'gauge'
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма длительностей (секунды) с метками"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], List[float]] = {}  # счетчики бакетов + [sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(state)) for key, state in self._values.items())
+        lines = self.header()
+        for key, state in items:
+            labels = _format_labels(self.label_names, key)
+            for bound, count in zip(self.buckets, state):
+                bucket_labels = _format_labels(self.label_names, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            inf_labels = _format_labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{labels} {state[-2]}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса; значения-функции вычисляются при каждом чтении"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._callbacks: Dict[str, Tuple[str, str, Callable[[], float]]] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def set_callback(self, name: str, kind: str, documentation: str, func: Callable[[], float]):
+        """Метрика без меток, значение которой берется из func (повторная регистрация заменяет старую)"""
+        self._callbacks[name] = (kind, documentation, func)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for name, (kind, documentation, func) in list(self._callbacks.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {kind}", f"{name} {value}"])
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter('tts_requests_total', 'Запросы на озвучку', ['voice', 'outcome'])
+CHARS_SYNTHESIZED = REGISTRY.counter('tts_chars_synthesized_total', 'Символы, отправленные в ElevenLabs', ['voice'])
+ERRORS = REGISTRY.counter('tts_errors_total', 'Ошибки по этапу и типу', ['stage', 'type'])
+IN_FLIGHT = REGISTRY.gauge('tts_in_flight', 'Запросы на озвучку в обработке')
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge('tts_upstream_in_flight', 'Запросы к ElevenLabs в процессе')
+JANITOR_RECLAIMED_BYTES = REGISTRY.counter('tts_janitor_reclaimed_bytes_total', 'Байты, освобожденные уборкой временных файлов')
+INLINE_QUERIES = REGISTRY.counter('tts_inline_queries_total', 'Inline-запросы по результату', ['outcome'])
+DOCUMENT_JOBS = REGISTRY.counter('tts_document_jobs_total', 'Озвучка документов по результату', ['outcome'])
+STARTUP_SECONDS = REGISTRY.gauge('tts_startup_seconds', 'Длительность этапов запуска: import, init, warmup, ready', ['phase'])
+STAGE_SECONDS = REGISTRY.histogram(
+    'tts_stage_seconds',
+    'Длительность этапов: queue_wait, upstream_ttfb, synthesis, upload, first_audio, total',
+    ['stage', 'voice'],
+)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        payload = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_metrics_server(host: str = METRICS_LISTEN, port: Optional[int] = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """
+    Запускает HTTP endpoint /metrics в фоновом потоке
+
+    Args:
+        host (str): Адрес для прослушивания
+        port (int): Порт; None или 0 - не запускать
+
+    Returns:
+        Optional[ThreadingHTTPServer]: Сервер или None, если endpoint выключен
+    """
+    if not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+class StageTimer:
+    """Замеры этапов одного запроса на озвучку: пишутся в STAGE_SECONDS и в итоговую строку лога"""
+
+    def __init__(self, voice: str):
+        self.voice = voice
+        self.stages: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    def record(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_SECONDS.observe(seconds, stage=stage, voice=self.voice)
+
+    def mark(self, stage: str):
+        """Записывает время от начала запроса до текущего момента (например, first_audio)"""
+        self.record(stage, time.perf_counter() - self._started)
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def finish(self, outcome: str) -> str:
+        """
+        Завершает замер запроса
+
+        Args:
+            outcome (str): Результат (ok, cached, file_id, error)
+
+        Returns:
+            str: Длительности этапов для лога
+        """
+        self.record('total', time.perf_counter() - self._started)
+        REQUESTS.inc(voice=self.voice, outcome=outcome)
+        return ' '.join(f"{stage}={seconds:.3f}s" for stage, seconds in self.stages.items())
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import sqlite3
+from collections import OrderedDict
+from typing import Dict, Optional
+import config
+
+# Хранилище настроек пользователей (голос, профиль вывода): 'sqlite' (по умолчанию) или 'redis'
+USER_STATE_BACKEND = getattr(config, 'USER_STATE_BACKEND', 'sqlite')
+USER_STATE_DB_PATH = getattr(config, 'USER_STATE_DB_PATH', 'user_state.db')
+USER_STATE_REDIS_URL = getattr(config, 'USER_STATE_REDIS_URL', 'redis://localhost:6379/0')
+# Сколько пользователей держим в памяти и как часто/какими пачками сбрасываем изменения
+USER_STATE_CACHE_SIZE = getattr(config, 'USER_STATE_CACHE_SIZE', 10000)
+USER_STATE_FLUSH_INTERVAL = getattr(config, 'USER_STATE_FLUSH_INTERVAL', 2.0)
+USER_STATE_FLUSH_BATCH = getattr(config, 'USER_STATE_FLUSH_BATCH', 500)
+
+_MISSING = object()
+
+
+class SQLiteStateBackend:
+    """Хранит настройку пользователей (по умолчанию voice_id) в таблице user_{field} локальной SQLite базы"""
+
+    def __init__(self, path: str = USER_STATE_DB_PATH, field: str = 'voice'):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._table = f'user_{field}'
+        self._column = f'{field}_id'
+        self._conn.execute(
+            f'CREATE TABLE IF NOT EXISTS {self._table} ('
+            f'user_id INTEGER PRIMARY KEY, {self._column} TEXT NOT NULL)'
+        )
+
+    def load(self, user_id: int) -> Optional[str]:
+        row = self._conn.execute(
+            f'SELECT {self._column} FROM {self._table} WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, changes: Dict[int, Optional[str]]):
+        updates = [(user_id, value) for user_id, value in changes.items() if value]
+        deletes = [(user_id,) for user_id, value in changes.items() if not value]
+        with self._conn:
+            self._conn.execute('BEGIN')
+            if updates:
+                self._conn.executemany(
+                    f'INSERT INTO {self._table} (user_id, {self._column}) VALUES (?, ?) '
+                    f'ON CONFLICT(user_id) DO UPDATE SET {self._column} = excluded.{self._column}',
+                    updates
+                )
+            if deletes:
+                self._conn.executemany(f'DELETE FROM {self._table} WHERE user_id = ?', deletes)
+
+    def close(self):
+        self._conn.close()
+
+
+class RedisStateBackend:
+    """Хранит настройку пользователей в хеше tts:user_{field} Redis-совместимого сервера (нужен пакет redis)"""
+
+    def __init__(self, url: str = USER_STATE_REDIS_URL, field: str = 'voice'):
+        self.hash_key = f'tts:user_{field}'
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("Для USER_STATE_BACKEND = 'redis' установите пакет redis: pip install redis") from e
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def load(self, user_id: int) -> Optional[str]:
+        return self._client.hget(self.hash_key, str(user_id))
+
+    def save_many(self, changes: Dict[int, Optional[str]]):
+        pipe = self._client.pipeline(transaction=False)
+        for user_id, value in changes.items():
+            if value:
+                pipe.hset(self.hash_key, str(user_id), value)
+            else:
+                pipe.hdel(self.hash_key, str(user_id))
+        pipe.execute()
+
+    def close(self):
+        self._client.close()
+
+
+def create_backend(name: str = USER_STATE_BACKEND, field: str = 'voice'):
+    """Создает хранилище настройки field по имени из конфигурации"""
+    if name == 'sqlite':
+        return SQLiteStateBackend(field=field)
+    if name == 'redis':
+        return RedisStateBackend(field=field)
+    raise ValueError(f"Неизвестный USER_STATE_BACKEND: {name}")
+
+
+class UserStateStore:
+    """
+    Настройка пользователей (выбранный голос, профиль вывода): ограниченный LRU в памяти
+    поверх постоянного хранилища. Изменения накапливаются и записываются пачками.
+    """
+
+    def __init__(self, backend=None, field: str = 'voice', cache_size: int = USER_STATE_CACHE_SIZE,
+                 flush_batch: int = USER_STATE_FLUSH_BATCH):
+        self.backend = backend or create_backend(field=field)
+        self.cache_size = cache_size
+        self.flush_batch = flush_batch
+
+        self._cache = OrderedDict()  # user_id -> значение (None - не выбрано)
+        self._dirty: Dict[int, Optional[str]] = {}
+
+    def get(self, user_id: int) -> Optional[str]:
+        """
+        Args:
+            user_id (int): ID пользователя Telegram
+
+        Returns:
+            Optional[str]: Выбранное значение (например, voice_id) или None
+        """
+        if user_id in self._dirty:
+            return self._dirty[user_id]
+        value = self._cache.get(user_id, _MISSING)
+        if value is _MISSING:
+            value = self.backend.load(user_id)
+            self._remember(user_id, value)
+        else:
+            self._cache.move_to_end(user_id)
+        return value
+
+    def set(self, user_id: int, value: Optional[str]):
+        """Запоминает выбор пользователя (None - сбросить); запись в хранилище отложенная"""
+        if self._cache.get(user_id, _MISSING) == value and user_id not in self._dirty:
+            self._cache.move_to_end(user_id)
+            return
+        self._remember(user_id, value)
+        self._dirty[user_id] = value
+        if len(self._dirty) >= self.flush_batch:
+            self.flush()
+
+    def _remember(self, user_id: int, value: Optional[str]):
+        self._cache[user_id] = value
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def flush(self):
+        """Записывает накопленные изменения в хранилище"""
+        if not self._dirty:
+            return
+        changes, self._dirty = self._dirty, {}
+        try:
+            self.backend.save_many(changes)
+        except Exception:
+            # Вернем изменения, чтобы записать их со следующей пачкой
+            changes.update(self._dirty)
+            self._dirty = changes
+            raise
+
+    async def run_flusher(self, interval: float = USER_STATE_FLUSH_INTERVAL):
+        """Фоновая задача: периодически сбрасывает изменения"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Ошибка при сохранении состояния пользователей: {e}")
+
+    def close(self):
+        """Сбрасывает изменения и закрывает хранилище"""
+        try:
+            self.flush()
+        finally:
+            self.backend.close()
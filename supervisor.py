@@ -0,0 +1,157 @@
+"""
+Многопроцессный режим бота (BOT_WORKERS > 1).
+
+Процесс-супервизор получает апдейты через long polling и раздает их N воркерам
+по хешу user_id, поэтому апдейты одного пользователя всегда обрабатывает один
+воркер. Каждый воркер - отдельный процесс с собственным event loop и
+TelegramTTSBot; дисковый кэш аудио, журнал file_id и состояние пользователей
+(SQLite/Redis) общие для всех воркеров.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+from typing import Dict, List, Optional
+from telegram import Bot, Update
+from telegram.error import NetworkError
+
+logger = logging.getLogger(__name__)
+
+# Таймаут long polling (секунды) и сколько ждать завершения воркера при остановке
+POLL_TIMEOUT = 30
+WORKER_SHUTDOWN_TIMEOUT = 30
+
+# Поля апдейта, в которых есть отправитель
+_USER_FIELDS = ('message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result')
+
+
+def shard_for(update: Dict, workers: int) -> int:
+    """
+    Номер воркера для апдейта: все апдейты одного пользователя попадают в один воркер
+
+    Args:
+        update (Dict): Апдейт Telegram в виде JSON
+        workers (int): Число воркеров
+
+    Returns:
+        int: Индекс воркера
+    """
+    for field in _USER_FIELDS:
+        payload = update.get(field)
+        if payload:
+            sender = payload.get('from') or payload.get('chat') or {}
+            return int(sender.get('id', 0)) % workers
+    return 0
+
+
+def _worker_main(index: int, workers: int, queue):
+    """Точка входа процесса-воркера"""
+    # Остановкой управляет супервизор (через None в очереди), Ctrl+C воркеры игнорируют
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # При запуске через spawn main.py уже выполнен как __mp_main__ и настроил логирование:
+    # force заменяет его обработчик, чтобы строки лога содержали номер воркера
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO,
+        force=True
+    )
+    import main as bot_module
+    bot = bot_module.TelegramTTSBot(worker_index=index, workers=workers)
+    asyncio.run(_serve(bot, queue))
+
+
+async def _serve(bot, queue):
+    """Передает апдейты из очереди супервизора в Application воркера"""
+    application = bot.build_application()
+    await application.initialize()
+    await bot.post_init(application)
+    await application.start()
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, queue.get)
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        await bot.post_shutdown(application)
+        await application.shutdown()
+
+
+class Supervisor:
+    """Запускает воркеры, перезапускает упавшие и раздает им апдейты"""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * workers
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.workers, self.queues[index]),
+            name=f'tts-worker-{index}',
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info("Воркер %d запущен (pid %s)", index, process.pid)
+
+    def _check_workers(self):
+        """Перезапускает упавшие воркеры; их очередь апдейтов сохраняется"""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error("Воркер %d завершился с кодом %s, перезапускаем", index, process.exitcode)
+                self._start_worker(index)
+
+    def dispatch(self, update: Dict):
+        self.queues[shard_for(update, self.workers)].put(update)
+
+    async def _poll(self, bot: Bot, allowed_updates: List[str]):
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed_updates)
+            except NetworkError as e:
+                logger.warning("Ошибка получения апдейтов: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.dispatch(update.to_dict())
+            self._check_workers()
+
+    async def run(self, bot: Bot, allowed_updates: List[str]):
+        """Запускает воркеры и раздает им апдейты до SIGINT/SIGTERM"""
+        for index in range(self.workers):
+            self._start_worker(index)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        async with bot:
+            await bot.delete_webhook()
+            poller = asyncio.create_task(self._poll(bot, allowed_updates))
+            stopper = asyncio.create_task(stop.wait())
+            await asyncio.wait({poller, stopper}, return_when=asyncio.FIRST_COMPLETED)
+            poller.cancel()
+            stopper.cancel()
+            if poller.done() and not poller.cancelled() and poller.exception():
+                logger.error("Получение апдейтов остановлено: %s", poller.exception())
+
+        logger.info("Останавливаем воркеры...")
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join(WORKER_SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+
+
+def run_supervisor(workers: int, bot: Bot, allowed_updates: List[str]):
+    """Запуск бота в многопроцессном режиме"""
+    logger.info("Запуск бота: %d воркеров", workers)
+    asyncio.run(Supervisor(workers).run(bot, allowed_updates))
@@ -0,0 +1,150 @@
+import re
+from typing import List
+
+# Границы абзацев и предложений
+_PARAGRAPH_RE = re.compile(r'\n\s*\n')
+_SENTENCE_RE = re.compile(r'(?<=[.!?…;])\s+')
+
+
+def _split_oversized(piece: str, max_chars: int) -> List[str]:
+    """Режет слишком длинное предложение по словам, а слово без пробелов - по символам"""
+    parts = []
+    current = ''
+    for word in piece.split():
+        while len(word) > max_chars:
+            if current:
+                parts.append(current)
+                current = ''
+            parts.append(word[:max_chars])
+            word = word[max_chars:]
+        if not word:
+            continue
+        candidate = f"{current} {word}" if current else word
+        if len(candidate) > max_chars:
+            parts.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Разбивает текст на фрагменты не длиннее max_chars по границам абзацев и предложений
+
+    Args:
+        text (str): Исходный текст
+        max_chars (int): Максимальная длина фрагмента
+
+    Returns:
+        List[str]: Фрагменты в исходном порядке
+    """
+    pieces = []
+    for paragraph in _PARAGRAPH_RE.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append((paragraph, True))
+            continue
+        for sentence in _SENTENCE_RE.split(paragraph):
+            sentence = sentence.strip()
+            if not sentence:
+                continue
+            if len(sentence) <= max_chars:
+                pieces.append((sentence, False))
+            else:
+                pieces.extend((part, False) for part in _split_oversized(sentence, max_chars))
+
+    # Жадно склеиваем соседние куски, чтобы запросов к API было меньше
+    chunks = []
+    current = ''
+    for piece, is_paragraph in pieces:
+        separator = '\n\n' if is_paragraph else ' '
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if len(candidate) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_progressive(text: str, first_chars: int, max_chars: int) -> List[str]:
+    """
+    Разбивает текст как split_text, но первый фрагмент ограничивает first_chars,
+    чтобы начало озвучки было готово быстро независимо от длины текста
+
+    Args:
+        text (str): Исходный текст
+        first_chars (int): Максимальная длина первого фрагмента
+        max_chars (int): Максимальная длина остальных фрагментов
+
+    Returns:
+        List[str]: Фрагменты в исходном порядке
+    """
+    chunks = split_text(text, max_chars)
+    if not chunks or len(chunks[0]) <= first_chars:
+        return chunks
+    head = split_text(chunks[0], first_chars)
+    if len(head) == 1:
+        return chunks
+    return [head[0]] + split_text(' '.join(head[1:]), max_chars) + chunks[1:]
+
+
+def strip_id3(segment: bytes) -> bytes:
+    """Убирает ID3v2 заголовок и ID3v1 хвост, оставляя только MP3 фреймы"""
+    if segment[:3] == b'ID3' and len(segment) >= 10:
+        size = 0
+        for byte in segment[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        footer = 10 if segment[5] & 0x10 else 0
+        segment = segment[10 + size + footer:]
+    if len(segment) >= 128 and segment[-128:-125] == b'TAG':
+        segment = segment[:-128]
+    return segment
+
+
+def join_mp3(segments: List[bytes]) -> bytes:
+    """
+    Склеивает MP3 фрагменты одного формата в один поток
+
+    Args:
+        segments (List[bytes]): MP3 фрагменты по порядку
+
+    Returns:
+        bytes: Единый MP3
+    """
+    if not segments:
+        return b''
+    return segments[0] + b''.join(strip_id3(segment) for segment in segments[1:])
+
+
+def group_segments(segments: List[bytes], max_bytes: int) -> List[List[bytes]]:
+    """
+    Группирует соседние фрагменты так, чтобы каждая группа помещалась в max_bytes
+
+    Args:
+        segments (List[bytes]): Аудио фрагменты по порядку
+        max_bytes (int): Максимальный размер группы
+
+    Returns:
+        List[List[bytes]]: Группы фрагментов по порядку
+    """
+    groups = []
+    current = []
+    current_size = 0
+    for segment in segments:
+        if current and current_size + len(segment) > max_bytes:
+            groups.append(current)
+            current = []
+            current_size = 0
+        current.append(segment)
+        current_size += len(segment)
+    if current:
+        groups.append(current)
+    return groups
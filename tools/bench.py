@@ -0,0 +1,239 @@
+"""
+Воспроизводимый нагрузочный бенчмарк бота.
+
+ElevenLabs заменяется локальной заглушкой (tools/fake_elevenlabs.py), Telegram -
+fake-сервером Bot API (tools/fake_telegram.py). Синтетические апдейты подаются
+в обработчики TelegramTTSBot через Application.process_update. Каждый сценарий
+запускается в отдельном процессе с чистыми кэшем и состоянием, чтобы результаты
+не влияли друг на друга и пиковая память считалась честно.
+
+Запуск:
+    python -m tools.bench                      # все сценарии
+    python -m tools.bench --scenario burst --latency 0.5 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+from tools.fake_telegram import FakeTelegramServer, make_callback_update, make_text_update
+
+# Стандартные сценарии: пользователи, запросы, вид текстов, длина текста и
+# интенсивность поступления (запросов в секунду, None - все сразу)
+SCENARIOS = {
+    'burst': {'users': 50, 'requests': 200, 'texts': 'unique', 'text_chars': 200, 'rate': None},
+    'repeated': {'users': 50, 'requests': 200, 'texts': 'repeated', 'phrases': 10, 'text_chars': 100, 'rate': None},
+    'long': {'users': 10, 'requests': 10, 'texts': 'unique', 'text_chars': 20000, 'rate': None},
+    'many_users': {'users': 1000, 'requests': 1000, 'texts': 'unique', 'text_chars': 150, 'rate': 50.0},
+}
+
+WORDS = (
+    'голос текст озвучка утро вечер привет спасибо сообщение бот новости погода '
+    'сегодня завтра встреча проект работа дом город музыка книга история'
+).split()
+
+
+def make_text(rng: random.Random, chars: int) -> str:
+    """Псевдослучайный текст из предложений примерно заданной длины"""
+    sentences = []
+    length = 0
+    while length < chars:
+        sentence = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 12))).capitalize() + '.'
+        sentences.append(sentence)
+        length += len(sentence) + 1
+    return ' '.join(sentences)[:chars]
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+
+def install_config(workdir: str, telegram_url: str, output_profile: str = 'mp3_128'):
+    """Подменяет config: тестовые токены, временные папки и адрес fake Telegram"""
+    try:
+        import config as base_config
+        values = {name: getattr(base_config, name) for name in dir(base_config) if name.isupper()}
+    except ImportError:
+        values = {}
+    values.update(
+        TELEGRAM_BOT_TOKEN='123456:BENCH',
+        ELEVENLABS_API_KEY='bench',
+        TEMP_AUDIO_DIR=os.path.join(workdir, 'audio'),
+        USER_STATE_DB_PATH=os.path.join(workdir, 'user_state.db'),
+        TELEGRAM_API_BASE_URL=telegram_url,
+        USER_STATE_BACKEND='sqlite',
+        METRICS_PORT=None,
+        # Прогрев не открывает соединения к настоящему ElevenLabs
+        WARMUP_CONNECTIONS=0,
+        OUTPUT_PROFILE=output_profile,
+    )
+    values.setdefault('MAX_TEXT_LENGTH', 5000)
+    # Кэш всегда во временной папке, чтобы прогоны не зависели друг от друга
+    values.pop('AUDIO_CACHE_DIR', None)
+    module = types.ModuleType('config')
+    module.__dict__.update(values)
+    sys.modules['config'] = module
+
+
+async def run_scenario(name: str, args) -> dict:
+    """Прогоняет один сценарий в текущем процессе"""
+    params = SCENARIOS[name]
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='tts-bench-')
+    server = FakeTelegramServer(port=0)
+    server.start()
+    install_config(workdir, server.base_url, args.output_profile)
+
+    # Импортируем бота только после подмены config
+    from telegram import Update
+    import main as bot_module
+    from voice import DEFAULT_VOICES
+    from tools.fake_elevenlabs import FakeElevenLabs
+
+    bot = bot_module.TelegramTTSBot()
+    upstream = FakeElevenLabs(
+        ttfb=args.latency,
+        seconds_per_char=args.seconds_per_char,
+        chunk_size=args.chunk_size,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    bot.voice_manager.client = upstream
+    application = bot.build_application()
+    await application.initialize()
+    await bot.post_init(application)
+
+    try:
+        users = [10_000 + i for i in range(params['users'])]
+        update_ids = iter(range(1, 10_000_000))
+
+        # Выбор голоса не измеряется
+        voice_id = DEFAULT_VOICES[0]['voice_id']
+        for user_id in users:
+            update = make_callback_update(next(update_ids), user_id, f"voice_{voice_id}")
+            await application.process_update(Update.de_json(update, application.bot))
+
+        if params['texts'] == 'repeated':
+            phrases = [make_text(rng, params['text_chars']) for _ in range(params['phrases'])]
+            texts = [rng.choice(phrases) for _ in range(params['requests'])]
+        else:
+            texts = [make_text(rng, params['text_chars']) + f' #{i}' for i in range(params['requests'])]
+
+        arrivals = []
+        at = 0.0
+        for _ in texts:
+            arrivals.append(at)
+            if params['rate']:
+                at += rng.expovariate(params['rate'])
+
+        latencies = []
+        calls_before = len(server.calls)
+
+        async def deliver(index: int, text: str, delay: float):
+            await asyncio.sleep(delay)
+            user_id = users[index % len(users)]
+            update = Update.de_json(make_text_update(next(update_ids), user_id, text), application.bot)
+            started = time.perf_counter()
+            await application.process_update(update)
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(deliver(i, text, delay) for i, (text, delay) in enumerate(zip(texts, arrivals))))
+        elapsed = time.perf_counter() - started
+
+        calls = server.calls[calls_before:]
+        uploads = sum(1 for call in calls if call['files'])
+        upload_bytes = sum(size for call in calls for size in call['files'].values())
+        return {
+            'scenario': name,
+            'requests': len(texts),
+            'seconds': round(elapsed, 3),
+            'throughput_rps': round(len(texts) / elapsed, 2) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'upstream_calls': upstream.calls,
+            'upstream_chars': upstream.chars,
+            'upstream_errors': upstream.errors,
+            'upstream_max_in_flight': upstream.max_in_flight,
+            'telegram_calls': len(calls),
+            'telegram_uploads': uploads,
+            'upload_mb': round(upload_bytes / 1024 / 1024, 1),
+        }
+    finally:
+        await bot.post_shutdown(application)
+        await application.shutdown()
+        server.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+COLUMNS = [
+    ('scenario', 12), ('requests', 9), ('throughput_rps', 15), ('p50_ms', 9), ('p95_ms', 9), ('p99_ms', 9),
+    ('peak_rss_mb', 12), ('upstream_calls', 15), ('upstream_errors', 16), ('telegram_uploads', 17), ('upload_mb', 10),
+]
+
+
+def print_table(results):
+    print(''.join(column.ljust(width) for column, width in COLUMNS))
+    for result in results:
+        print(''.join(str(result.get(column, '')).ljust(width) for column, width in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный бенчмарк TTS бота')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Сценарий (можно несколько); по умолчанию все')
+    parser.add_argument('--latency', type=float, default=0.3, help='Задержка ElevenLabs до первого чанка, с')
+    parser.add_argument('--seconds-per-char', type=float, default=0.0005, help='Время генерации на символ, с')
+    parser.add_argument('--chunk-size', type=int, default=4096, help='Размер чанка ответа ElevenLabs, байт')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ошибок ElevenLabs (0..1)')
+    parser.add_argument('--output-profile', default='mp3_128', help='Профиль вывода (OUTPUT_PROFILE), например opus_32')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Сохранить результаты в JSON файл')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+
+    if args.child:
+        result = asyncio.run(run_scenario(scenarios[0], args))
+        print(json.dumps(result))
+        return
+
+    results = []
+    passthrough = [
+        '--latency', str(args.latency), '--seconds-per-char', str(args.seconds_per_char),
+        '--chunk-size', str(args.chunk_size), '--error-rate', str(args.error_rate), '--seed', str(args.seed),
+        '--output-profile', args.output_profile,
+    ]
+    for name in scenarios:
+        completed = subprocess.run(
+            [sys.executable, '-m', 'tools.bench', '--child', '--scenario', name] + passthrough,
+            capture_output=True, text=True,
+        )
+        if completed.returncode != 0:
+            print(f"Сценарий {name} завершился с ошибкой:\n{completed.stderr}", file=sys.stderr)
+            continue
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    print_table(results)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
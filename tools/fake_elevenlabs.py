@@ -0,0 +1,125 @@
+"""
+Локальная заглушка клиента ElevenLabs для нагрузочных тестов.
+
+Повторяет используемую ботом часть интерфейса ElevenLabs SDK
+(text_to_speech.convert / text_to_speech.stream и voices.get_all) и
+имитирует задержку ответа, размер чанков и долю ошибок.
+"""
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Iterator
+
+from voice import DEFAULT_VOICES
+
+try:
+    from elevenlabs.core.api_error import ApiError
+except ImportError:  # старые версии SDK
+    ApiError = None
+
+
+class FakeUpstreamError(Exception):
+    """Ошибка заглушки, если в SDK нет ApiError"""
+
+
+class _FakeTextToSpeech:
+    def __init__(self, client: 'FakeElevenLabs'):
+        self._client = client
+
+    def convert(self, text: str, voice_id: str, model_id: str = None, output_format: str = None, **kwargs) -> Iterator[bytes]:
+        return self._client._synthesize(text, output_format)
+
+    def stream(self, text: str, voice_id: str, model_id: str = None, output_format: str = None, **kwargs) -> Iterator[bytes]:
+        return self._client._synthesize(text, output_format)
+
+
+class _FakeVoices:
+    def get_all(self, **kwargs):
+        return SimpleNamespace(voices=[
+            SimpleNamespace(
+                voice_id=voice['voice_id'],
+                name=voice['name'],
+                description=voice['description'],
+                category=voice['category'],
+                labels=voice['labels'],
+                preview_url=voice['preview_url'],
+            )
+            for voice in DEFAULT_VOICES
+        ])
+
+
+def _bitrate(output_format: str = None) -> int:
+    """Битрейт (кбит/с) из имени формата ElevenLabs, например mp3_44100_128 -> 128"""
+    try:
+        return int((output_format or '').rsplit('_', 1)[1])
+    except (IndexError, ValueError):
+        return 128
+
+
+class FakeElevenLabs:
+    """
+    Заглушка ElevenLabs: задержка до первого чанка (ttfb) плюс время на "генерацию"
+    пропорционально длине текста, ответ режется на чанки chunk_size байт.
+    """
+
+    def __init__(self, ttfb: float = 0.3, seconds_per_char: float = 0.0005, chunk_size: int = 4096,
+                 bytes_per_char: int = 1000, error_rate: float = 0.0, seed: int = 0):
+        self.ttfb = ttfb
+        self.seconds_per_char = seconds_per_char
+        self.chunk_size = chunk_size
+        self.bytes_per_char = bytes_per_char
+        self.error_rate = error_rate
+
+        self.text_to_speech = _FakeTextToSpeech(self)
+        self.voices = _FakeVoices()
+
+        self.calls = 0
+        self.chars = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def _synthesize(self, text: str, output_format: str = None) -> Iterator[bytes]:
+        with self._lock:
+            self.calls += 1
+            self.chars += len(text)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            fail = self._random.random() < self.error_rate
+        try:
+            time.sleep(self.ttfb)
+            if fail:
+                with self._lock:
+                    self.errors += 1
+                if ApiError is not None:
+                    raise ApiError(status_code=503, body='fake upstream error')
+                raise FakeUpstreamError('fake upstream error')
+
+            # bytes_per_char задан для 128 кбит/с, размер ответа пропорционален битрейту формата
+            total = max(len(text) * self.bytes_per_char * _bitrate(output_format) // 128, 1)
+            chunks = (total + self.chunk_size - 1) // self.chunk_size
+            delay = len(text) * self.seconds_per_char / chunks
+            # Фрейм-подобный заголовок, чтобы склейка MP3 работала как с настоящими данными
+            payload = b'\xff\xfb' + bytes(self.chunk_size - 2)
+            sent = 0
+            while sent < total:
+                if delay:
+                    time.sleep(delay)
+                size = min(self.chunk_size, total - sent)
+                sent += size
+                yield payload[:size]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'chars': self.chars,
+                'errors': self.errors,
+                'max_in_flight': self.max_in_flight,
+            }
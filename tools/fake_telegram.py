@@ -0,0 +1,245 @@
+"""
+Локальный fake-сервер Telegram Bot API для проверки бота без настоящего Telegram.
+
+Бот направляется на сервер параметром TELEGRAM_API_BASE_URL в config.py
+(например, "http://127.0.0.1:8081"). Сервер отвечает на вызовы Bot API,
+запоминает их, а апдейты отдает через getUpdates (polling) или отправляет
+POST-запросами на webhook бота.
+
+Пример проверки режима webhook:
+    python -m tools.fake_telegram --webhook http://127.0.0.1:8443/telegram --secret SECRET --updates 20
+"""
+import argparse
+import email.parser
+import email.policy
+import itertools
+import json
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+def make_text_update(update_id: int, user_id: int, text: str, message_id: int = None) -> Dict:
+    """Апдейт с текстовым сообщением от пользователя в личном чате"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': message_id or update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'text': text,
+            **({'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]}
+               if text.startswith('/') else {}),
+        },
+    }
+
+
+def make_callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> Dict:
+    """Апдейт с нажатием inline-кнопки"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private', 'first_name': f'User{user_id}'},
+                'text': 'menu',
+            },
+        },
+    }
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Бот открывает много соединений одновременно
+    request_queue_size = 1024
+
+
+class FakeTelegramServer:
+    """Fake Bot API: запоминает вызовы методов и раздает апдейты"""
+
+    BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_tts_bot'}
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081):
+        self.calls: List[Dict] = []
+        self.updates: 'queue.Queue[Dict]' = queue.Queue()
+        self.webhook: Optional[Dict] = None
+
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1_000_000)
+        self._file_ids = itertools.count(1)
+        self._server = _Server((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def count(self, method: str) -> int:
+        with self._lock:
+            return sum(1 for call in self.calls if call['method'] == method)
+
+    def post_update(self, url: str, update: Dict, secret_token: str = None) -> int:
+        """Отправляет апдейт на webhook бота, как это делает Telegram"""
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(update).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+        )
+        if secret_token:
+            request.add_header('X-Telegram-Bot-Api-Secret-Token', secret_token)
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+
+    def _message(self, params: Dict, **extra) -> Dict:
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': self.BOT_USER,
+            **extra,
+        }
+
+    def _media(self, params: Dict, kind: str) -> Dict:
+        value = params.get(kind)
+        # Повторная отправка по file_id возвращает тот же file_id
+        if isinstance(value, str) and value.startswith('fake-file-'):
+            file_id = value
+        else:
+            file_id = f"fake-file-{next(self._file_ids)}"
+        media = {'file_id': file_id, 'file_unique_id': file_id, 'duration': 1}
+        return self._message(params, **{kind: media, 'caption': params.get('caption', '')})
+
+    def handle(self, method: str, params: Dict, files: Dict[str, int]):
+        """Результат вызова метода Bot API"""
+        with self._lock:
+            self.calls.append({'method': method, 'params': params, 'files': files, 'time': time.monotonic()})
+
+        if method == 'getMe':
+            return self.BOT_USER
+        if method == 'getUpdates':
+            timeout = float(params.get('timeout') or 0)
+            updates = []
+            try:
+                updates.append(self.updates.get(timeout=min(timeout, 1.0)))
+                while len(updates) < 100:
+                    updates.append(self.updates.get_nowait())
+            except queue.Empty:
+                pass
+            return updates
+        if method == 'setWebhook':
+            self.webhook = params
+            return True
+        if method in ('sendMessage', 'editMessageText'):
+            return self._message(params, text=params.get('text', ''))
+        if method == 'sendAudio':
+            return self._media(params, 'audio')
+        if method == 'sendVoice':
+            return self._media(params, 'voice')
+        if method == 'sendDocument':
+            return self._media(params, 'document')
+        return True
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                # /bot<token>/<method>
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                params, files = _parse_body(self.headers.get('Content-Type', ''), body)
+                result = server.handle(method, params, files)
+                payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+        return Handler
+
+
+def _parse_body(content_type: str, body: bytes):
+    """Параметры вызова: JSON, urlencoded или multipart (для файлов запоминается только размер)"""
+    params, files = {}, {}
+    if not body:
+        return params, files
+    if content_type.startswith('application/json'):
+        return json.loads(body), files
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            data = part.get_payload(decode=True) or b''
+            if part.get_filename():
+                files[name] = len(data)
+                params[name] = f"attach://{name}"
+            else:
+                params[name] = data.decode('utf-8', 'replace')
+        return params, files
+    from urllib.parse import parse_qsl
+    return dict(parse_qsl(body.decode('utf-8'))), files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Telegram Bot API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--webhook', help='URL webhook бота; без него апдейты отдаются через getUpdates')
+    parser.add_argument('--secret', help='Секретный токен webhook')
+    parser.add_argument('--updates', type=int, default=10, help='Сколько текстовых апдейтов отправить')
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--wait', type=float, default=10.0, help='Сколько секунд ждать ответов бота')
+    args = parser.parse_args()
+
+    server = FakeTelegramServer(args.host, args.port)
+    server.start()
+    print(f"Fake Telegram запущен на {server.base_url}")
+
+    for update_id in range(1, args.updates + 1):
+        update = make_text_update(update_id, 100 + update_id % args.users, f"Тестовый текст номер {update_id}")
+        if args.webhook:
+            status = server.post_update(args.webhook, update, args.secret)
+            if status != 200:
+                print(f"Webhook ответил {status} на апдейт {update_id}")
+        else:
+            server.updates.put(update)
+
+    time.sleep(args.wait)
+    with server._lock:
+        methods = sorted({call['method'] for call in server.calls})
+    for method in methods:
+        print(f"{method}: {server.count(method)}")
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
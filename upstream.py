@@ -0,0 +1,186 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+import httpx
+import config
+
+# Общий HTTP пул к ElevenLabs: keep-alive соединения переиспользуются всеми запросами процесса
+ELEVENLABS_TIMEOUT = getattr(config, 'ELEVENLABS_TIMEOUT', 30.0)
+ELEVENLABS_MAX_CONNECTIONS = getattr(config, 'ELEVENLABS_MAX_CONNECTIONS', 32)
+# Сколько секунд простаивающее соединение остается в пуле (прогретые при запуске соединения не закрываются сразу)
+ELEVENLABS_KEEPALIVE_EXPIRY = getattr(config, 'ELEVENLABS_KEEPALIVE_EXPIRY', 60.0)
+# Повторы при 429/5xx и сетевых ошибках: число повторов и экспоненциальная задержка с джиттером
+ELEVENLABS_MAX_RETRIES = getattr(config, 'ELEVENLABS_MAX_RETRIES', 3)
+ELEVENLABS_RETRY_BACKOFF = getattr(config, 'ELEVENLABS_RETRY_BACKOFF', 0.5)
+ELEVENLABS_RETRY_BACKOFF_MAX = getattr(config, 'ELEVENLABS_RETRY_BACKOFF_MAX', 8.0)
+# Circuit breaker: после стольких неудач подряд запросы не отправляются CIRCUIT_RESET_TIMEOUT секунд
+CIRCUIT_FAILURE_THRESHOLD = getattr(config, 'CIRCUIT_FAILURE_THRESHOLD', 5)
+CIRCUIT_RESET_TIMEOUT = getattr(config, 'CIRCUIT_RESET_TIMEOUT', 30.0)
+
+T = TypeVar('T')
+
+_http_client: Optional[httpx.Client] = None
+_http_client_lock = threading.Lock()
+
+
+class UpstreamUnavailable(Exception):
+    """ElevenLabs недоступен: circuit breaker разомкнут, запрос не отправлялся"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"ElevenLabs недоступен, повторите через {retry_in:.0f} с")
+        self.retry_in = retry_in
+
+
+def get_http_client() -> httpx.Client:
+    """Общий для процесса httpx клиент с пулом keep-alive соединений"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = httpx.Client(
+                timeout=httpx.Timeout(ELEVENLABS_TIMEOUT, connect=10.0),
+                limits=httpx.Limits(
+                    max_connections=ELEVENLABS_MAX_CONNECTIONS,
+                    max_keepalive_connections=ELEVENLABS_MAX_CONNECTIONS,
+                    keepalive_expiry=ELEVENLABS_KEEPALIVE_EXPIRY,
+                ),
+                follow_redirects=True,
+            )
+        return _http_client
+
+
+def open_connections(url: str, count: int) -> int:
+    """
+    Заранее открывает до count keep-alive соединений общего пула (DNS, TCP и TLS),
+    чтобы первые запросы синтеза не тратили на это время
+
+    Args:
+        url (str): Адрес API (любой ответ сервера оставляет соединение в пуле)
+        count (int): Сколько соединений открыть параллельно
+
+    Returns:
+        int: Сколько соединений удалось открыть
+    """
+    client = get_http_client()
+
+    def ping(_) -> bool:
+        try:
+            client.head(url)
+            return True
+        except httpx.HTTPError as e:
+            print(f"Не удалось открыть соединение с {url}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix='warmup') as pool:
+        return sum(pool.map(ping, range(count)))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Стоит ли повторять запрос: 408/409/429, 5xx, таймауты и сетевые ошибки"""
+    if isinstance(error, httpx.TransportError):
+        return True
+    # ApiError из SDK ElevenLabs
+    status = getattr(error, 'status_code', None)
+    return isinstance(status, int) and (status >= 500 or status in (408, 409, 429))
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    """Задержка перед повтором: Retry-After от сервера или full jitter backoff"""
+    headers = getattr(error, 'headers', None) or {}
+    retry_after = headers.get('retry-after') or headers.get('Retry-After')
+    if retry_after:
+        try:
+            return min(float(retry_after), ELEVENLABS_RETRY_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(ELEVENLABS_RETRY_BACKOFF_MAX, ELEVENLABS_RETRY_BACKOFF * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Размыкается после failure_threshold неудачных запросов подряд: следующие reset_timeout
+    секунд запросы сразу получают UpstreamUnavailable. Затем пропускается один пробный
+    запрос - при успехе цепь замыкается, при неудаче снова размыкается.
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """Проверяет, можно ли отправить запрос; иначе бросает UpstreamUnavailable"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+            if remaining <= 0 and not self._probe:
+                self._probe = True
+                return
+            raise UpstreamUnavailable(max(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probe or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self._probe = False
+
+
+def call_with_retries(func: Callable[[], T], breaker: CircuitBreaker, max_retries: int = ELEVENLABS_MAX_RETRIES,
+                      on_retry: Callable[[Exception], None] = None) -> T:
+    """
+    Вызывает func с повторами на временных ошибках ElevenLabs
+
+    Args:
+        func (Callable): Запрос к ElevenLabs целиком (повторяется с начала)
+        breaker (CircuitBreaker): Circuit breaker апстрима
+        max_retries (int): Сколько раз повторять после первой попытки
+        on_retry (Callable, optional): Вызывается с ошибкой перед каждым повтором
+
+    Returns:
+        T: Результат func
+
+    Raises:
+        UpstreamUnavailable: Если circuit breaker разомкнут
+        Exception: Последняя ошибка func, если повторы не помогли или ошибка не временная
+    """
+    attempt = 0
+    while True:
+        breaker.allow()
+        try:
+            result = func()
+        except Exception as e:
+            if not is_retryable(e):
+                # Ошибка запроса (например, 400 или 401) не говорит о недоступности сервиса
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt >= max_retries:
+                raise
+            if on_retry:
+                on_retry(e)
+            time.sleep(retry_delay(e, attempt))
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
@@ -1,114 +1,354 @@
 import os
 import json
-from typing import List, Dict, Optional
-from elevenlabs.client import ElevenLabs
-from elevenlabs import save
+import asyncio
+import functools
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncContextManager, AsyncIterator, Callable, Iterator, List, Dict, Optional
 import config
+import metrics
+from upstream import (
+    CircuitBreaker, UpstreamUnavailable, ELEVENLABS_TIMEOUT, call_with_retries, get_http_client, open_connections,
+)
+from audio_cache import AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES, AudioCache, make_cache_key
+from janitor import InUseFiles, TempJanitor
+from concurrency import SingleFlight
+from voice_catalog import VoiceCatalog
+from text_chunks import split_text, split_progressive, join_mp3, group_segments
+
+# Слот планировщика для одного запроса к ElevenLabs: slot(cost) -> async context manager
+ChunkSlot = Optional[Callable[[int], AsyncContextManager]]
+
+# Модель синтеза (входит в ключ кэша)
+TTS_MODEL_ID = "eleven_multilingual_v2"
+
+# Профили вывода: формат ElevenLabs (входит в ключ кэша), расширение файла и способ отправки.
+# Opus отправляется голосовым сообщением (send_voice); Ogg-файлы нельзя склеить простой
+# конкатенацией, поэтому длинный текст в Opus приходит серией сообщений
+OUTPUT_PROFILES = {
+    'mp3_128': {'format': 'mp3_44100_128', 'extension': 'mp3', 'voice_note': False, 'label': 'MP3 128 кбит/с'},
+    'mp3_64': {'format': 'mp3_44100_64', 'extension': 'mp3', 'voice_note': False, 'label': 'MP3 64 кбит/с'},
+    'mp3_32': {'format': 'mp3_22050_32', 'extension': 'mp3', 'voice_note': False, 'label': 'MP3 32 кбит/с'},
+    'opus_64': {'format': 'opus_48000_64', 'extension': 'ogg', 'voice_note': True, 'label': 'Голосовое, Opus 64 кбит/с'},
+    'opus_32': {'format': 'opus_48000_32', 'extension': 'ogg', 'voice_note': True, 'label': 'Голосовое, Opus 32 кбит/с'},
+}
+# Профиль по умолчанию для всех пользователей (каждый может выбрать свой командой /format)
+OUTPUT_PROFILE = getattr(config, 'OUTPUT_PROFILE', 'mp3_128')
+if OUTPUT_PROFILE not in OUTPUT_PROFILES:
+    raise ValueError(f"Неизвестный OUTPUT_PROFILE: {OUTPUT_PROFILE}")
+
+# Сколько запросов синтеза может выполняться одновременно
+TTS_MAX_CONCURRENCY = getattr(config, 'TTS_MAX_CONCURRENCY', 8)
+
+# Доставка аудио: 'memory' - клип собирается в памяти и сразу загружается в Telegram,
+# 'file' - через временный файл в TEMP_AUDIO_DIR
+AUDIO_DELIVERY_MODE = getattr(config, 'AUDIO_DELIVERY_MODE', 'memory')
+# Максимальный размер клипа в памяти (лимит Telegram на загрузку ботом - 50 МБ)
+MAX_AUDIO_BUFFER_BYTES = getattr(config, 'MAX_AUDIO_BUFFER_BYTES', 20 * 1024 * 1024)
+
+# Длинные тексты: максимальная длина, сколько фрагментов одного текста синтезируется
+# одновременно и максимальный размер одного аудио файла для Telegram
+MAX_LONG_TEXT_LENGTH = getattr(config, 'MAX_LONG_TEXT_LENGTH', 50000)
+TTS_CHUNK_FANOUT = getattr(config, 'TTS_CHUNK_FANOUT', 4)
+TELEGRAM_MAX_AUDIO_BYTES = getattr(config, 'TELEGRAM_MAX_AUDIO_BYTES', 48 * 1024 * 1024)
+
+# Прогрессивная отправка текстов длиннее PROGRESSIVE_MIN_CHARS: начало озвучки (до FIRST_SEGMENT_CHARS
+# символов) отправляется сразу, остальное - следом по порядку, не дожидаясь всего текста
+PROGRESSIVE_DELIVERY = getattr(config, 'PROGRESSIVE_DELIVERY', True)
+FIRST_SEGMENT_CHARS = getattr(config, 'FIRST_SEGMENT_CHARS', 300)
+PROGRESSIVE_MIN_CHARS = getattr(config, 'PROGRESSIVE_MIN_CHARS', 1000)
+
+# Hedging: если за HEDGE_AFTER секунд ElevenLabs не прислал ни одного байта, отправляется
+# дублирующий запрос и используется ответ, пришедший первым (0 - выключено, дубль тратит символы)
+HEDGE_AFTER = getattr(config, 'HEDGE_AFTER', 0)
+# Сколько дублирующих запросов выполняется одновременно: у них свой пул потоков, поэтому
+# дубль стартует вовремя, даже когда все потоки синтеза заняты медленными запросами
+HEDGE_MAX_CONCURRENCY = getattr(config, 'HEDGE_MAX_CONCURRENCY', 4)
+# Потоки для чтения озвучки из кэша (не ждут в очереди за запросами к ElevenLabs и их повторами)
+CACHE_READ_WORKERS = 4
+
+# Предустановленные голоса ElevenLabs, доступные всем пользователям
+# (используются, пока не загружен список голосов аккаунта)
+DEFAULT_VOICES = [
+    {
+        'voice_id': '21m00Tcm4TlvDq8ikWAM',  # Rachel
+        'name': 'Rachel',
+        'description': 'Calm, soothing voice perfect for narration',
+        'category': 'premade',
+        'labels': {'gender': 'female', 'age': 'young_adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'AZnzlk1XvdvUeBnXmlld',  # Domi
+        'name': 'Domi',
+        'description': 'Confident, strong voice with authority',
+        'category': 'premade',
+        'labels': {'gender': 'female', 'age': 'middle_aged'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'EXAVITQu4vr4xnSDxMaL',  # Bella
+        'name': 'Bella',
+        'description': 'Warm, friendly voice with character',
+        'category': 'premade',
+        'labels': {'gender': 'female', 'age': 'young_adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'ErXwobaYiN019PkySvjV',  # Antoni
+        'name': 'Antoni',
+        'description': 'Professional, clear male voice',
+        'category': 'premade',
+        'labels': {'gender': 'male', 'age': 'young_adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'MF3mGyEYCl7XYWbV9V6O',  # Elli
+        'name': 'Elli',
+        'description': 'Energetic, upbeat voice',
+        'category': 'premade',
+        'labels': {'gender': 'female', 'age': 'young_adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'TxGEqnHWrfWFTfGW9XjX',  # Josh
+        'name': 'Josh',
+        'description': 'Deep, resonant male voice',
+        'category': 'premade',
+        'labels': {'gender': 'male', 'age': 'adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'VR6AewLTigWG4xSOukaG',  # Arnold
+        'name': 'Arnold',
+        'description': 'Strong, authoritative male voice',
+        'category': 'premade',
+        'labels': {'gender': 'male', 'age': 'adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'pNInz6obpgDQGcFmaJgB',  # Adam
+        'name': 'Adam',
+        'description': 'Clear, professional male voice',
+        'category': 'premade',
+        'labels': {'gender': 'male', 'age': 'young_adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': 'yoZ06aMxZJJ28mfd3POQ',  # Sam
+        'name': 'Sam',
+        'description': 'Friendly, approachable male voice',
+        'category': 'premade',
+        'labels': {'gender': 'male', 'age': 'young_adult'},
+        'preview_url': ''
+    },
+    {
+        'voice_id': '2EiwWnXFnvU5JabPnv8n',  # Clyde
+        'name': 'Clyde',
+        'description': 'Wise, mature male voice',
+        'category': 'premade',
+        'labels': {'gender': 'male', 'age': 'senior'},
+        'preview_url': ''
+    }
+]
+
+def get_output_profile(name: Optional[str]) -> Dict:
+    """Профиль вывода по имени; неизвестное имя или None - профиль по умолчанию"""
+    return OUTPUT_PROFILES.get(name) or OUTPUT_PROFILES[OUTPUT_PROFILE]
+
 
 class VoiceManager:
     """Класс для управления голосами и генерацией аудио через ElevenLabs API"""
     
-    def __init__(self):
-        self.client = ElevenLabs(api_key=config.ELEVENLABS_API_KEY)
+    def __init__(self, cache_max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        # Клиент ElevenLabs создается при первом запросе (или при прогреве): импорт SDK
+        # и создание пула соединений не замедляют запуск
+        self._client = None
+        self._client_lock = threading.Lock()
+        # Повторы и circuit breaker для запросов синтеза
+        self.breaker = CircuitBreaker()
+
+        # Пул потоков для синхронного SDK: ограничивает число одновременных запросов
+        # к ElevenLabs и не блокирует event loop бота
+        self._executor = ThreadPoolExecutor(
+            max_workers=TTS_MAX_CONCURRENCY,
+            thread_name_prefix='tts'
+        )
+        self._hedge_executor = ThreadPoolExecutor(
+            max_workers=HEDGE_MAX_CONCURRENCY,
+            thread_name_prefix='tts-hedge'
+        )
+        self._cache_executor = ThreadPoolExecutor(
+            max_workers=CACHE_READ_WORKERS,
+            thread_name_prefix='tts-cache'
+        )
         
         # Создаем папку для временных аудио файлов
         if not os.path.exists(config.TEMP_AUDIO_DIR):
             os.makedirs(config.TEMP_AUDIO_DIR)
+        # Занятые временные файлы не удаляются уборкой
+        self.temp_files = InUseFiles()
+        self.janitor = TempJanitor([config.TEMP_AUDIO_DIR, AUDIO_CACHE_DIR], self.temp_files)
+
+        # Каталог голосов: загружается один раз и обновляется в фоне
+        self.catalog = VoiceCatalog(self._fetch_account_voices, DEFAULT_VOICES)
+
+        # Кэш уже озвученных фраз: повторный запрос не идет в API
+        # (cache_max_bytes - бюджет этого процесса, в многопроцессном режиме - доля воркера)
+        self.audio_cache = AudioCache(max_bytes=cache_max_bytes)
+        # Одинаковые запросы, пришедшие одновременно, ждут один общий вызов API
+        self._inflight = SingleFlight()
+        
+        metrics.REGISTRY.set_callback('tts_cache_hits_total', 'counter', 'Попадания в кэш аудио', lambda: self.audio_cache.hits)
+        metrics.REGISTRY.set_callback('tts_cache_misses_total', 'counter', 'Промахи кэша аудио', lambda: self.audio_cache.misses)
+        metrics.REGISTRY.set_callback('tts_cache_bytes', 'gauge', 'Размер кэша аудио', lambda: self.audio_cache.stats()['bytes'])
+        metrics.REGISTRY.set_callback('tts_circuit_open', 'gauge', 'Circuit breaker ElevenLabs разомкнут (1)', lambda: int(self.breaker.state == 'open'))
+        metrics.REGISTRY.set_callback('tts_singleflight_shared_total', 'counter', 'Запросы, получившие результат одновременного такого же запроса', lambda: self._inflight.shared)
+    
+    @property
+    def client(self):
+        """Клиент ElevenLabs SDK (создается при первом обращении)"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from elevenlabs.client import ElevenLabs
+                    # Все менеджеры процесса используют один пул keep-alive соединений к ElevenLabs
+                    self._client = ElevenLabs(
+                        api_key=config.ELEVENLABS_API_KEY,
+                        timeout=ELEVENLABS_TIMEOUT,
+                        httpx_client=get_http_client()
+                    )
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def warm_up(self, connections: int = 0) -> Dict[str, float]:
+        """
+        Готовит ресурсы до первого запроса пользователя
+        
+        Args:
+            connections (int): Сколько keep-alive соединений к ElevenLabs открыть заранее
+            
+        Returns:
+            Dict[str, float]: Длительность шагов (sdk, cache_index, catalog, connections) в секундах
+        """
+        timings = {}
+        started = time.perf_counter()
+        self.client  # импорт SDK и создание клиента с пулом соединений
+        timings['sdk'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.audio_cache.load_index()
+        timings['cache_index'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        self.catalog.refresh()
+        timings['catalog'] = time.perf_counter() - started
+
+        if connections:
+            started = time.perf_counter()
+            # Клиент создается без base_url, то есть с адресом по умолчанию
+            from elevenlabs.environment import ElevenLabsEnvironment
+            open_connections(ElevenLabsEnvironment.PRODUCTION.value, connections)
+            timings['connections'] = time.perf_counter() - started
+        return timings
     
     def get_voices(self) -> List[Dict]:
         """
-        Получает список доступных голосов (предустановленные голоса ElevenLabs)
+        Получает список доступных голосов аккаунта из кэшированного каталога
         
         Returns:
             List[Dict]: Список голосов с их характеристиками
         """
-        # Предустановленные голоса ElevenLabs, доступные всем пользователям
-        default_voices = [
-            {
-                'voice_id': '21m00Tcm4TlvDq8ikWAM',  # Rachel
-                'name': 'Rachel',
-                'description': 'Calm, soothing voice perfect for narration',
-                'category': 'premade',
-                'labels': {'gender': 'female', 'age': 'young_adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'AZnzlk1XvdvUeBnXmlld',  # Domi
-                'name': 'Domi',
-                'description': 'Confident, strong voice with authority',
-                'category': 'premade',
-                'labels': {'gender': 'female', 'age': 'middle_aged'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'EXAVITQu4vr4xnSDxMaL',  # Bella
-                'name': 'Bella',
-                'description': 'Warm, friendly voice with character',
-                'category': 'premade',
-                'labels': {'gender': 'female', 'age': 'young_adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'ErXwobaYiN019PkySvjV',  # Antoni
-                'name': 'Antoni',
-                'description': 'Professional, clear male voice',
-                'category': 'premade',
-                'labels': {'gender': 'male', 'age': 'young_adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'MF3mGyEYCl7XYWbV9V6O',  # Elli
-                'name': 'Elli',
-                'description': 'Energetic, upbeat voice',
-                'category': 'premade',
-                'labels': {'gender': 'female', 'age': 'young_adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'TxGEqnHWrfWFTfGW9XjX',  # Josh
-                'name': 'Josh',
-                'description': 'Deep, resonant male voice',
-                'category': 'premade',
-                'labels': {'gender': 'male', 'age': 'adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'VR6AewLTigWG4xSOukaG',  # Arnold
-                'name': 'Arnold',
-                'description': 'Strong, authoritative male voice',
-                'category': 'premade',
-                'labels': {'gender': 'male', 'age': 'adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'pNInz6obpgDQGcFmaJgB',  # Adam
-                'name': 'Adam',
-                'description': 'Clear, professional male voice',
-                'category': 'premade',
-                'labels': {'gender': 'male', 'age': 'young_adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': 'yoZ06aMxZJJ28mfd3POQ',  # Sam
-                'name': 'Sam',
-                'description': 'Friendly, approachable male voice',
-                'category': 'premade',
-                'labels': {'gender': 'male', 'age': 'young_adult'},
-                'preview_url': ''
-            },
-            {
-                'voice_id': '2EiwWnXFnvU5JabPnv8n',  # Clyde
-                'name': 'Clyde',
-                'description': 'Wise, mature male voice',
-                'category': 'premade',
-                'labels': {'gender': 'male', 'age': 'senior'},
-                'preview_url': ''
-            }
-        ]
-        
-        return default_voices
-    
-    def generate_audio(self, text: str, voice_id: str, output_filename: str = None) -> Optional[str]:
+        return self.catalog.voices()
+    
+    def _fetch_account_voices(self) -> List[Dict]:
+        """Загружает голоса аккаунта из ElevenLabs API"""
+        response = self.client.voices.get_all()
+        voices = []
+        for voice in response.voices:
+            voices.append({
+                'voice_id': voice.voice_id,
+                'name': voice.name or 'Unknown',
+                'description': voice.description or '',
+                'category': voice.category or '',
+                'labels': dict(voice.labels or {}),
+                'preview_url': voice.preview_url or ''
+            })
+        return voices
+    
+    def cache_key(self, text: str, voice_id: str, profile: str = OUTPUT_PROFILE) -> str:
+        """
+        Ключ кэша для текста и голоса с текущими моделью и форматом
+        
+        Args:
+            text (str): Текст для озвучки
+            voice_id (str): ID голоса для озвучки
+            profile (str): Профиль вывода (битрейт и формат входят в ключ)
+            
+        Returns:
+            str: Ключ кэша
+        """
+        return make_cache_key(text, voice_id, TTS_MODEL_ID, get_output_profile(profile)['format'])
+    
+    def _timed_upstream(self, audio: Iterator[bytes], text: str, voice_id: str) -> Iterator[bytes]:
+        """Пропускает чанки ответа ElevenLabs, замеряя время до первого байта и полный синтез"""
+        metrics.UPSTREAM_IN_FLIGHT.inc()
+        metrics.CHARS_SYNTHESIZED.inc(len(text), voice=voice_id)
+        started = time.perf_counter()
+        first_chunk = True
+        try:
+            for chunk in audio:
+                if first_chunk:
+                    metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='upstream_ttfb', voice=voice_id)
+                    first_chunk = False
+                yield chunk
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, stage='synthesis', voice=voice_id)
+        finally:
+            metrics.UPSTREAM_IN_FLIGHT.dec()
+    
+    def _synthesize(self, text: str, voice_id: str, profile: str,
+                    first_byte: threading.Event = None, cancelled: threading.Event = None) -> Optional[bytes]:
+        """Один запрос синтеза: собирает ответ в буфер не больше MAX_AUDIO_BUFFER_BYTES"""
+        audio = self.client.text_to_speech.convert(
+            text=text,
+            voice_id=voice_id,
+            model_id=TTS_MODEL_ID,
+            output_format=get_output_profile(profile)['format']
+        )
+        
+        # Собираем чанки в буфер, не позволяя ему вырасти больше лимита
+        buffer = bytearray()
+        for chunk in self._timed_upstream(audio, text, voice_id):
+            if first_byte is not None:
+                first_byte.set()
+            if cancelled is not None and cancelled.is_set():
+                return None
+            buffer.extend(chunk)
+            if len(buffer) > MAX_AUDIO_BUFFER_BYTES:
+                print(f"Аудио превышает лимит буфера {MAX_AUDIO_BUFFER_BYTES} байт")
+                metrics.ERRORS.inc(stage='synthesis', type='AudioTooLarge')
+                return None
+        return bytes(buffer)
+    
+    def _synthesize_with_retries(self, text: str, voice_id: str, profile: str,
+                                 first_byte: threading.Event = None, cancelled: threading.Event = None) -> Optional[bytes]:
+        """Синтез с повторами на 429/5xx и сетевых ошибках через circuit breaker"""
+        def on_retry(error: Exception):
+            print(f"Временная ошибка ElevenLabs, повторяем запрос: {error}")
+            metrics.ERRORS.inc(stage='upstream_retry', type=type(error).__name__)
+        
+        return call_with_retries(
+            lambda: self._synthesize(text, voice_id, profile, first_byte, cancelled),
+            self.breaker,
+            on_retry=on_retry
+        )
+    
+    def generate_audio(self, text: str, voice_id: str, output_filename: str = None, profile: str = OUTPUT_PROFILE) -> Optional[str]:
         """
         Генерирует аудио из текста с использованием указанного голоса
         
@@ -116,11 +356,13 @@ class VoiceManager:
             text (str): Текст для озвучки
             voice_id (str): ID голоса для озвучки
             output_filename (str, optional): Имя файла для сохранения аудио
+            profile (str): Профиль вывода из OUTPUT_PROFILES
             
         Returns:
             Optional[str]: Путь к сгенерированному аудио файлу или None в случае ошибки
         """
         try:
+            output = get_output_profile(profile)
             # Проверяем длину текста
             if len(text) > config.MAX_TEXT_LENGTH:
                 print(f"Текст слишком длинный. Максимум {config.MAX_TEXT_LENGTH} символов")
@@ -128,33 +370,316 @@ class VoiceManager:
             
             # Генерируем имя файла если не указано
             if not output_filename:
-                import time
                 timestamp = int(time.time())
-                output_filename = f"audio_{timestamp}.mp3"
+                output_filename = f"audio_{timestamp}.{output['extension']}"
             
             # Убеждаемся что файл имеет правильное расширение
-            if not output_filename.endswith(('.mp3', '.wav')):
-                output_filename += '.mp3'
+            if not output_filename.endswith(('.mp3', '.wav', '.ogg')):
+                output_filename += f".{output['extension']}"
             
             file_path = os.path.join(config.TEMP_AUDIO_DIR, output_filename)
             
-            # Генерируем аудио используя официальную библиотеку
-            audio = self.client.text_to_speech.convert(
-                text=text,
-                voice_id=voice_id,
-                model_id="eleven_multilingual_v2",
-                output_format="mp3_44100_128"
-            )
+            # Если такая фраза уже озвучивалась этим голосом - берем из кэша
+            key = self.cache_key(text, voice_id, profile)
+            cached_path = self.audio_cache.get(key)
+            if cached_path:
+                with self.temp_files.hold(file_path):
+                    shutil.copyfile(cached_path, file_path)
+                print(f"Аудио взято из кэша: {file_path}")
+                return file_path
+            
+            # Генерируем аудио используя официальную библиотеку (с повторами при временных ошибках)
+            audio_data = self._synthesize_with_retries(text, voice_id, profile)
+            if audio_data is None:
+                return None
             
             # Сохраняем аудио файл
-            save(audio, file_path)
+            with self.temp_files.hold(file_path), open(file_path, 'wb') as f:
+                f.write(audio_data)
+            
+            try:
+                self.audio_cache.put_file(key, file_path)
+            except OSError as e:
+                print(f"Не удалось сохранить аудио в кэш: {e}")
             
             print(f"Аудио успешно сгенерировано: {file_path}")
             return file_path
             
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            print(f"Ошибка при генерации аудио: {e}")
+            metrics.ERRORS.inc(stage='synthesis', type=type(e).__name__)
+            return None
+    
+    def generate_audio_bytes(self, text: str, voice_id: str, profile: str = OUTPUT_PROFILE,
+                             first_byte: threading.Event = None, cancelled: threading.Event = None) -> Optional[bytes]:
+        """
+        Генерирует аудио в память без временных файлов
+        
+        Args:
+            text (str): Текст для озвучки
+            voice_id (str): ID голоса для озвучки
+            profile (str): Профиль вывода из OUTPUT_PROFILES
+            first_byte (threading.Event, optional): Устанавливается, когда пришел первый чанк ответа
+            cancelled (threading.Event, optional): Если установлено, чтение ответа прерывается (hedging)
+            
+        Returns:
+            Optional[bytes]: Аудио в формате профиля или None в случае ошибки или превышения MAX_AUDIO_BUFFER_BYTES
+            
+        Raises:
+            UpstreamUnavailable: Если ElevenLabs недоступен (circuit breaker разомкнут)
+        """
+        try:
+            # Проверяем длину текста
+            if len(text) > config.MAX_TEXT_LENGTH:
+                print(f"Текст слишком длинный. Максимум {config.MAX_TEXT_LENGTH} символов")
+                return None
+            
+            key = self.cache_key(text, voice_id, profile)
+            cached_audio = self.audio_cache.get_bytes(key)
+            if cached_audio is not None:
+                return cached_audio
+            
+            audio_data = self._synthesize_with_retries(text, voice_id, profile, first_byte, cancelled)
+            if audio_data is None:
+                return None
+            
+            try:
+                self.audio_cache.put_bytes(key, audio_data)
+            except OSError as e:
+                print(f"Не удалось сохранить аудио в кэш: {e}")
+            
+            return audio_data
+            
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
             print(f"Ошибка при генерации аудио: {e}")
+            metrics.ERRORS.inc(stage='synthesis', type=type(e).__name__)
+            return None
+    
+    async def agenerate_audio_bytes(self, text: str, voice_id: str, profile: str = OUTPUT_PROFILE) -> Optional[bytes]:
+        """
+        Асинхронная версия generate_audio_bytes (пул потоков, не более TTS_MAX_CONCURRENCY запросов).
+        Одновременные запросы с тем же текстом и голосом разделяют один вызов API
+        
+        Args:
+            text (str): Текст для озвучки
+            voice_id (str): ID голоса для озвучки
+            profile (str): Профиль вывода из OUTPUT_PROFILES
+            
+        Returns:
+            Optional[bytes]: Аудио в формате профиля или None в случае ошибки
+            
+        Raises:
+            UpstreamUnavailable: Если ElevenLabs недоступен (circuit breaker разомкнут)
+        """
+        return await self._inflight.do(
+            self.cache_key(text, voice_id, profile),
+            lambda: self._hedged_generate(text, voice_id, profile)
+        )
+    
+    async def _hedged_generate(self, text: str, voice_id: str, profile: str) -> Optional[bytes]:
+        """
+        Выполняет generate_audio_bytes в пуле потоков; если включен HEDGE_AFTER и за это время
+        не пришло ни байта, запускает дублирующий запрос и возвращает первый успешный ответ
+        """
+        loop = asyncio.get_running_loop()
+        executor = self._executor_for(text, voice_id, profile)
+        cancelled = threading.Event()
+        first_byte = threading.Event()
+        primary = loop.run_in_executor(
+            executor,
+            functools.partial(self.generate_audio_bytes, text, voice_id, profile, first_byte, cancelled)
+        )
+        if not HEDGE_AFTER or executor is self._cache_executor:
+            return await primary
+        
+        done, _ = await asyncio.wait({primary}, timeout=HEDGE_AFTER)
+        if done or first_byte.is_set():
+            return await primary
+        
+        metrics.ERRORS.inc(stage='upstream_hedge', type='SlowFirstByte')
+        hedge = loop.run_in_executor(
+            self._hedge_executor,
+            functools.partial(self.generate_audio_bytes, text, voice_id, profile, None, cancelled)
+        )
+        error = None
+        try:
+            for next_done in asyncio.as_completed([primary, hedge]):
+                try:
+                    result = await next_done
+                except Exception as e:
+                    error = e
+                    continue
+                if result is not None:
+                    return result
+            if error is not None:
+                raise error
             return None
+        finally:
+            # Проигравший запрос перестает читать ответ и закрывает соединение
+            cancelled.set()
+    
+    def _executor_for(self, text: str, voice_id: str, profile: str) -> ThreadPoolExecutor:
+        """Пул потоков для запроса: чтение из кэша не ждет потоков синтеза"""
+        if self.audio_cache.contains(self.cache_key(text, voice_id, profile)):
+            return self._cache_executor
+        return self._executor
+    
+    async def _agenerate_chunk(self, chunk: str, voice_id: str, profile: str, slot: ChunkSlot = None) -> Optional[bytes]:
+        """Фрагмент длинного текста: из кэша сразу, иначе в отдельном слоте планировщика (если задан)"""
+        if slot is None or self.audio_cache.contains(self.cache_key(chunk, voice_id, profile)):
+            return await self.agenerate_audio_bytes(chunk, voice_id, profile)
+        async with slot(len(chunk)):
+            return await self.agenerate_audio_bytes(chunk, voice_id, profile)
+    
+    def progressive_cached(self, text: str, voice_id: str, profile: str = OUTPUT_PROFILE) -> bool:
+        """
+        Проверяет, что все фрагменты прогрессивной озвучки текста уже в кэше
+        (текст уже отправлялся по частям) и их можно склеить в один MP3
+        
+        Args:
+            text (str): Текст для озвучки
+            voice_id (str): ID голоса для озвучки
+            profile (str): Профиль вывода из OUTPUT_PROFILES (Opus-фрагменты не склеиваются)
+            
+        Returns:
+            bool: True, если клип целиком собирается из кэша без запросов к ElevenLabs
+        """
+        if get_output_profile(profile)['voice_note']:
+            return False
+        chunks = split_progressive(text, FIRST_SEGMENT_CHARS, config.MAX_TEXT_LENGTH)
+        return all(self.audio_cache.contains(self.cache_key(chunk, voice_id, profile)) for chunk in chunks)
+    
+    async def agenerate_long_audio(self, text: str, voice_id: str, profile: str = OUTPUT_PROFILE,
+                                   slot: ChunkSlot = None, progressive: bool = False) -> Optional[List[bytes]]:
+        """
+        Озвучивает текст длиннее MAX_TEXT_LENGTH: режет его по абзацам и предложениям,
+        синтезирует фрагменты параллельно (не более TTS_CHUNK_FANOUT одновременно)
+        и склеивает MP3 по порядку
+        
+        Args:
+            text (str): Текст для озвучки (до MAX_LONG_TEXT_LENGTH символов)
+            voice_id (str): ID голоса для озвучки
+            profile (str): Профиль вывода из OUTPUT_PROFILES
+            slot (Callable, optional): slot(cost) - слот планировщика на каждый запрос фрагмента к ElevenLabs
+            progressive (bool): Резать текст как astream_long_audio, чтобы взять его фрагменты из кэша
+            
+        Returns:
+            Optional[List[bytes]]: Один MP3 или несколько частей, если общий размер больше
+            TELEGRAM_MAX_AUDIO_BYTES (для Opus - каждый фрагмент отдельно); None в случае ошибки
+        """
+        if len(text) > MAX_LONG_TEXT_LENGTH:
+            print(f"Текст слишком длинный. Максимум {MAX_LONG_TEXT_LENGTH} символов")
+            return None
+        
+        if progressive:
+            chunks = split_progressive(text, FIRST_SEGMENT_CHARS, config.MAX_TEXT_LENGTH)
+        else:
+            chunks = split_text(text, config.MAX_TEXT_LENGTH)
+        semaphore = asyncio.Semaphore(TTS_CHUNK_FANOUT)
+        
+        async def synthesize_chunk(chunk: str) -> Optional[bytes]:
+            async with semaphore:
+                return await self._agenerate_chunk(chunk, voice_id, profile, slot)
+        
+        segments = await asyncio.gather(*(synthesize_chunk(chunk) for chunk in chunks))
+        if not segments or any(segment is None for segment in segments):
+            print("Не удалось озвучить один из фрагментов текста")
+            return None
+        
+        if get_output_profile(profile)['voice_note']:
+            return segments
+        return [join_mp3(group) for group in group_segments(segments, TELEGRAM_MAX_AUDIO_BYTES)]
+    
+    async def astream_long_audio(self, text: str, voice_id: str, profile: str = OUTPUT_PROFILE,
+                                 slot: ChunkSlot = None) -> AsyncIterator[bytes]:
+        """
+        Прогрессивная озвучка длинного текста: первый фрагмент короткий (FIRST_SEGMENT_CHARS)
+        и отдается сразу после синтеза, следующие - по порядку по мере готовности.
+        Готовые к моменту отправки соседние фрагменты склеиваются в одну часть
+        
+        Args:
+            text (str): Текст для озвучки (до MAX_LONG_TEXT_LENGTH символов)
+            voice_id (str): ID голоса для озвучки
+            profile (str): Профиль вывода из OUTPUT_PROFILES (Opus-фрагменты не склеиваются)
+            slot (Callable, optional): slot(cost) - слот планировщика на каждый запрос фрагмента к ElevenLabs
+            
+        Yields:
+            bytes: Очередная часть озвучки не больше TELEGRAM_MAX_AUDIO_BYTES
+            
+        Raises:
+            RuntimeError: Если фрагмент не удалось озвучить (уже отданные части остаются у вызывающего)
+        """
+        if len(text) > MAX_LONG_TEXT_LENGTH:
+            raise RuntimeError(f"Текст слишком длинный. Максимум {MAX_LONG_TEXT_LENGTH} символов")
+        
+        chunks = split_progressive(text, FIRST_SEGMENT_CHARS, config.MAX_TEXT_LENGTH)
+        semaphore = asyncio.Semaphore(TTS_CHUNK_FANOUT)
+        can_join = not get_output_profile(profile)['voice_note']
+        
+        async def synthesize_chunk(chunk: str) -> Optional[bytes]:
+            async with semaphore:
+                return await self._agenerate_chunk(chunk, voice_id, profile, slot)
+        
+        # Задачи создаются по порядку, поэтому семафор пропускает начало текста первым
+        tasks = [asyncio.ensure_future(synthesize_chunk(chunk)) for chunk in chunks]
+        try:
+            index = 0
+            while index < len(tasks):
+                group = [await tasks[index]]
+                if group[0] is None:
+                    raise RuntimeError("Не удалось озвучить один из фрагментов текста")
+                size = len(group[0])
+                index += 1
+                # Первую часть отдаем сразу, к остальным добавляем уже готовые следующие фрагменты
+                while can_join and index > 1 and index < len(tasks) and tasks[index].done():
+                    segment = tasks[index].result()
+                    if segment is None or size + len(segment) > TELEGRAM_MAX_AUDIO_BYTES:
+                        break
+                    group.append(segment)
+                    size += len(segment)
+                    index += 1
+                yield join_mp3(group)
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def agenerate_audio(self, text: str, voice_id: str, output_filename: str = None, profile: str = OUTPUT_PROFILE) -> Optional[str]:
+        """
+        Асинхронная версия generate_audio: синтез выполняется в пуле потоков,
+        не более TTS_MAX_CONCURRENCY запросов одновременно
+        
+        Args:
+            text (str): Текст для озвучки
+            voice_id (str): ID голоса для озвучки
+            output_filename (str, optional): Имя файла для сохранения аудио
+            profile (str): Профиль вывода из OUTPUT_PROFILES
+            
+        Returns:
+            Optional[str]: Путь к сгенерированному аудио файлу или None в случае ошибки
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor_for(text, voice_id, profile),
+            functools.partial(self.generate_audio, text, voice_id, output_filename, profile)
+        )
+    
+    def get_voice_by_id(self, voice_id: Optional[str]) -> Optional[Dict]:
+        """
+        Находит голос по ID
+        
+        Args:
+            voice_id (str): ID голоса
+            
+        Returns:
+            Optional[Dict]: Данные голоса или None если не найден
+        """
+        if not voice_id:
+            return None
+        return self.catalog.get(voice_id)
     
     def get_voice_by_name(self, voice_name: str) -> Optional[Dict]:
         """
@@ -166,11 +691,7 @@ class VoiceManager:
         Returns:
             Optional[Dict]: Данные голоса или None если не найден
         """
-        voices = self.get_voices()
-        for voice in voices:
-            if voice['name'].lower() == voice_name.lower():
-                return voice
-        return None
+        return self.catalog.get_by_name(voice_name)
     
     def get_default_voices(self) -> List[Dict]:
         """
@@ -187,30 +708,40 @@ class VoiceManager:
         return popular_voices
     
     def cleanup_temp_files(self):
-        """Очищает временные аудио файлы"""
+        """
+        Очищает временные аудио файлы, кроме тех, что сейчас пишутся или отправляются.
+        Файлы моложе TEMP_FILE_MIN_AGE не удаляются: это могут быть недописанные *.tmp
+        кэша аудио и журнала file_id, в том числе других воркеров
+        """
         try:
-            if os.path.exists(config.TEMP_AUDIO_DIR):
-                for filename in os.listdir(config.TEMP_AUDIO_DIR):
-                    file_path = os.path.join(config.TEMP_AUDIO_DIR, filename)
-                    if os.path.isfile(file_path):
-                        os.remove(file_path)
-                print("Временные файлы очищены")
+            removed, reclaimed = self.janitor.sweep(max_age=0)
+            print(f"Временные файлы очищены: {removed}, освобождено {reclaimed} байт")
         except Exception as e:
             print(f"Ошибка при очистке временных файлов: {e}")
 
 
+_shared_manager: Optional[VoiceManager] = None
+_shared_manager_lock = threading.Lock()
+
+
+def get_voice_manager() -> VoiceManager:
+    """Общий для процесса VoiceManager (клиент, кэш и каталог создаются один раз)"""
+    global _shared_manager
+    with _shared_manager_lock:
+        if _shared_manager is None:
+            _shared_manager = VoiceManager()
+        return _shared_manager
+
+
 # Функции для удобного использования
 def get_available_voices() -> List[Dict]:
     """Получить список доступных голосов"""
-    voice_manager = VoiceManager()
-    return voice_manager.get_voices()
+    return get_voice_manager().get_voices()
 
 def text_to_speech(text: str, voice_id: str, output_filename: str = None) -> Optional[str]:
     """Конвертировать текст в речь"""
-    voice_manager = VoiceManager()
-    return voice_manager.generate_audio(text, voice_id, output_filename)
+    return get_voice_manager().generate_audio(text, voice_id, output_filename)
 
 def get_voice_by_name(voice_name: str) -> Optional[Dict]:
     """Найти голос по имени"""
-    voice_manager = VoiceManager()
-    return voice_manager.get_voice_by_name(voice_name)
+    return get_voice_manager().get_voice_by_name(voice_name)
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional
+import config
+
+# Как часто обновлять список голосов аккаунта (секунды)
+VOICE_CATALOG_TTL = getattr(config, 'VOICE_CATALOG_TTL', 3600)
+
+
+class _Snapshot:
+    """Неизменяемый снимок каталога с индексами"""
+
+    def __init__(self, voices: List[Dict]):
+        self.voices = voices
+        self.by_id = {}
+        self.by_name = {}
+        for voice in voices:
+            voice_id = voice.get('voice_id') or voice.get('id')
+            if voice_id:
+                self.by_id[voice_id] = voice
+            name = voice.get('name')
+            if name:
+                self.by_name.setdefault(name.lower(), voice)
+        self.loaded_at = time.monotonic()
+
+
+class VoiceCatalog:
+    """
+    Кэшированный каталог голосов с O(1) поиском по voice_id и имени.
+
+    Список загружается один раз при первом обращении и затем обновляется
+    в фоне раз в ttl секунд. Пока загрузка не удалась, используются голоса по умолчанию.
+    """
+
+    def __init__(self, fetch: Callable[[], List[Dict]], fallback: List[Dict], ttl: float = VOICE_CATALOG_TTL):
+        self._fetch = fetch
+        self.ttl = ttl
+        self._snapshot = _Snapshot(list(fallback))
+        self._loaded = False
+
+    def _current(self) -> _Snapshot:
+        if not self._loaded:
+            self.refresh()
+        return self._snapshot
+
+    def refresh(self) -> bool:
+        """
+        Загружает актуальный список голосов и атомарно подменяет снимок
+
+        Returns:
+            bool: True, если список обновлен
+        """
+        self._loaded = True
+        try:
+            voices = self._fetch()
+        except Exception as e:
+            print(f"Не удалось загрузить список голосов: {e}")
+            return False
+        if not voices:
+            return False
+        self._snapshot = _Snapshot(voices)
+        return True
+
+    async def run_refresher(self):
+        """Фоновая задача: обновляет каталог раз в ttl секунд, не блокируя event loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.ttl)
+            await loop.run_in_executor(None, self.refresh)
+
+    def voices(self) -> List[Dict]:
+        """Список голосов из текущего снимка (не копируется)"""
+        return self._current().voices
+
+    def get(self, voice_id: str) -> Optional[Dict]:
+        return self._current().by_id.get(voice_id)
+
+    def get_by_name(self, name: str) -> Optional[Dict]:
+        return self._current().by_name.get(name.lower())